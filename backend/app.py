@@ -46,6 +46,7 @@ def create_app():
     from routes.reviews import reviews_bp
     from routes.users import users_bp
     from routes.photos import photos_bp
+    from routes.map import map_bp
     
     app.register_blueprint(auth_bp, url_prefix='/api/auth')
     app.register_blueprint(cats_bp, url_prefix='/api/cats')
@@ -54,6 +55,23 @@ def create_app():
     app.register_blueprint(reviews_bp, url_prefix='/api/reviews')
     app.register_blueprint(users_bp, url_prefix='/api/users')
     app.register_blueprint(photos_bp, url_prefix='/api/photos')
+    app.register_blueprint(map_bp, url_prefix='/api/map')
+    
+    # Background writer for recently viewed items and geocoder for new bodegas
+    from utils.geocode_worker import geocode_worker
+    from utils.views import view_buffer
+    view_buffer.init_app(app)
+    geocode_worker.init_app(app)
+    
+    # Maintenance commands
+    from migrations import db_cli
+    from utils.reconcile import reconcile_command
+    from utils.views import compact_command
+    from utils.geocode_worker import retry_failed_command
+    app.cli.add_command(reconcile_command)
+    app.cli.add_command(compact_command)
+    app.cli.add_command(retry_failed_command)
+    app.cli.add_command(db_cli)
     
     # Health check endpoint
     @app.route('/api/health')
@@ -95,8 +113,14 @@ def create_app():
             db.create_all()
             print("Database tables created successfully")
             
+            # Full-text search indexes are created outside the ORM models
+            from utils.fulltext import setup_fulltext
+            search_engine = setup_fulltext()
+            print(f"Full-text search engine: {search_engine or 'ilike'}")
+            
             # Check if we need to add sample data
             from models import User, Bodega, Cat, Review
+            from utils.ratings import apply_review_change
             if not User.query.first():
                 print("Adding sample data...")
                 
@@ -121,8 +145,6 @@ def create_app():
                         description="A friendly neighborhood deli with great sandwiches and an even better cat.",
                         phone="(718) 555-0123",
                         hours="6:00 AM - 11:00 PM",
-                        rating=4.5,
-                        review_count=12,
                         cat_count=1,
                         is_verified=True
                     ),
@@ -134,8 +156,6 @@ def create_app():
                         description="Family-owned market with fresh produce and a resident tabby cat.",
                         phone="(718) 555-0456",
                         hours="7:00 AM - 10:00 PM",
-                        rating=4.2,
-                        review_count=8,
                         cat_count=1,
                         is_verified=True
                     ),
@@ -147,8 +167,6 @@ def create_app():
                         description="24/7 convenience store with a sleepy orange cat that loves attention.",
                         phone="(212) 555-0789",
                         hours="24/7",
-                        rating=4.0,
-                        review_count=15,
                         cat_count=1,
                         is_verified=False
                     ),
@@ -170,9 +188,7 @@ def create_app():
                         personality="Friendly, curious, loves attention",
                         color="Orange tabby",
                         weight="12 lbs",
-                        is_friendly=True,
-                        rating=4.8,
-                        review_count=10
+                        is_friendly=True
                     ),
                     Cat(
                         name="Shadow",
@@ -184,9 +200,7 @@ def create_app():
                         personality="Independent, watchful, gentle",
                         color="Black",
                         weight="10 lbs",
-                        is_friendly=True,
-                        rating=4.5,
-                        review_count=7
+                        is_friendly=True
                     ),
                     Cat(
                         name="Mittens",
@@ -198,9 +212,7 @@ def create_app():
                         personality="Calm, affectionate, sleepy",
                         color="White with black paws",
                         weight="8 lbs",
-                        is_friendly=True,
-                        rating=4.2,
-                        review_count=12
+                        is_friendly=True
                     ),
                 ]
                 
@@ -208,6 +220,30 @@ def create_app():
                     db.session.add(cat)
                 db.session.commit()
                 
+                # Create sample reviews; the ratings shown come from these
+                reviews = [
+                    Review(user_id=1, bodega_id=1, rating=5, comment="Best chopped cheese in the neighborhood."),
+                    Review(user_id=2, bodega_id=1, rating=5, comment="Friendly staff and an even friendlier cat."),
+                    Review(user_id=3, bodega_id=1, rating=4, comment="Great sandwiches, a bit crowded at lunch."),
+                    Review(user_id=1, bodega_id=2, rating=4, comment="Fresh produce every morning."),
+                    Review(user_id=2, bodega_id=2, rating=5, comment="Lovely family and a very calm cat."),
+                    Review(user_id=3, bodega_id=2, rating=4, comment="Good prices, small aisles."),
+                    Review(user_id=1, bodega_id=3, rating=4, comment="Open all night when you need it."),
+                    Review(user_id=2, bodega_id=3, rating=4, comment="Convenient, and the cat is always asleep."),
+                    Review(user_id=1, cat_id=1, rating=5, comment="Greeted me at the door!"),
+                    Review(user_id=2, cat_id=1, rating=5, comment="The friendliest tabby in Brooklyn."),
+                    Review(user_id=3, cat_id=1, rating=5, comment="Let me scratch behind his ears."),
+                    Review(user_id=1, cat_id=2, rating=5, comment="Watched me from the top shelf the whole time."),
+                    Review(user_id=2, cat_id=2, rating=4, comment="Shy at first but very sweet."),
+                    Review(user_id=1, cat_id=3, rating=4, comment="Napping in the sun, as promised."),
+                    Review(user_id=3, cat_id=3, rating=5, comment="So fluffy."),
+                ]
+                
+                for review in reviews:
+                    db.session.add(review)
+                    apply_review_change(review.cat_id, review.bodega_id, added=review.rating)
+                db.session.commit()
+                
                 print("Sample data added successfully")
             else:
                 print("Database already contains data")
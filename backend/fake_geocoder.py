@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Google Maps Geocoding API
+
+    python fake_geocoder.py --port 8081 [--delay 0.5] [--failure-rate 0.1]
+    GEOCODE_BASE_URL=http://localhost:8081 python app.py
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Rough bounding box of New York City
+MIN_LAT, MAX_LAT = 40.50, 40.91
+MIN_LNG, MAX_LNG = -74.25, -73.70
+
+
+def fake_location(address):
+    digest = hashlib.sha256(address.lower().encode()).digest()
+    lat = MIN_LAT + (MAX_LAT - MIN_LAT) * int.from_bytes(digest[:4], 'big') / 2 ** 32
+    lng = MIN_LNG + (MAX_LNG - MIN_LNG) * int.from_bytes(digest[4:8], 'big') / 2 ** 32
+    return round(lat, 6), round(lng, 6)
+
+
+class FakeGeocoderHandler(BaseHTTPRequestHandler):
+    delay = 0.0
+    failure_rate = 0.0
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+        if self.delay:
+            time.sleep(self.delay)
+        if url.path.rstrip('/') != '/json':
+            return self.respond(404, {'error': 'Not found'})
+        if random.random() < self.failure_rate:
+            return self.respond(503, {'error': 'Simulated failure'})
+
+        # Stable coordinates inside NYC per address; "nowhere" finds nothing
+        if 'address' in params:
+            address = params['address']
+            if 'nowhere' in address.lower():
+                return self.respond(200, {'status': 'ZERO_RESULTS', 'results': []})
+            lat, lng = fake_location(address)
+            result = {'formatted_address': address, 'geometry': {'location': {'lat': lat, 'lng': lng}}}
+        elif 'latlng' in params:
+            result = {'formatted_address': f"Near {params['latlng']}, New York, NY, USA"}
+        else:
+            return self.respond(200, {'status': 'INVALID_REQUEST', 'results': []})
+
+        self.respond(200, {'status': 'OK', 'results': [result]})
+
+    def respond(self, status, body):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Google Maps Geocoding API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before each response')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    args = parser.parse_args()
+
+    FakeGeocoderHandler.delay = args.delay
+    FakeGeocoderHandler.failure_rate = args.failure_rate
+    # HTTP/1.1 keeps connections alive, like the real provider; without Nagle's
+    # algorithm the separately written headers and body are not held back
+    FakeGeocoderHandler.protocol_version = 'HTTP/1.1'
+    FakeGeocoderHandler.disable_nagle_algorithm = True
+
+    server = ThreadingHTTPServer((args.host, args.port), FakeGeocoderHandler)
+    print(f"Fake geocoder listening on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""Versioned schema migrations, each applied once per database and recorded in schema_migrations."""
+
+import importlib
+import pkgutil
+import re
+from datetime import datetime
+from typing import List, Tuple
+
+import click
+from flask.cli import AppGroup
+from sqlalchemy import inspect
+
+from models import db
+
+VERSIONS_PACKAGE = 'migrations.versions'
+
+SCHEMA_MIGRATIONS = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(255) PRIMARY KEY,
+        applied_at TIMESTAMP NOT NULL
+    )
+"""
+
+
+def column_exists(conn, table: str, column: str) -> bool:
+    return column in {c['name'] for c in inspect(conn).get_columns(table)}
+
+
+def add_column(conn, table: str, column: str, definition: str) -> None:
+    """Add a column unless the table already has it"""
+    if column_exists(conn, table, column):
+        print(f"  {table}.{column} already exists")
+        return
+    conn.execute(db.text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+    print(f"  ✓ Added {column} column to {table} table")
+
+
+def create_index(conn, name: str, table: str, columns: List[str], unique: bool = False) -> None:
+    """Create an index unless one with that name exists"""
+    conn.execute(db.text(
+        f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {name} ON {table} ({', '.join(columns)})"
+    ))
+    print(f"  ✓ Index {name} on {table} ({', '.join(columns)})")
+
+
+def drop_not_null(conn, table: str, columns: List[str]) -> None:
+    """
+    Make columns nullable
+
+    SQLite cannot alter a column, so the table is rebuilt from its own
+    definition with the NOT NULL constraints removed, and its indexes and
+    triggers are recreated.
+    """
+    nullable = {c['name'] for c in inspect(conn).get_columns(table) if c['nullable']}
+    columns = [column for column in columns if column not in nullable]
+    if not columns:
+        print(f"  {table} columns already nullable")
+        return
+
+    if conn.dialect.name != 'sqlite':
+        for column in columns:
+            conn.execute(db.text(f"ALTER TABLE {table} ALTER COLUMN {column} DROP NOT NULL"))
+    else:
+        schema = conn.execute(
+            db.text("SELECT type, sql FROM sqlite_master WHERE tbl_name = :table AND sql IS NOT NULL"),
+            {'table': table}
+        ).all()
+        create = next(sql for kind, sql in schema if kind == 'table')
+        for column in columns:
+            create, found = re.subn(rf'(\b{column}\s+\w+(?:\([^)]*\))?)\s+NOT NULL', r'\1', create, count=1)
+            if not found:
+                raise RuntimeError(f"Cannot find the NOT NULL constraint of {table}.{column}")
+        create = re.sub(rf'^CREATE TABLE\s+"?{table}"?', f'CREATE TABLE {table}_rebuilt', create)
+
+        conn.execute(db.text(create))
+        conn.execute(db.text(f"INSERT INTO {table}_rebuilt SELECT * FROM {table}"))
+        conn.execute(db.text(f"DROP TABLE {table}"))
+        # Skip the schema check that would reject triggers on other tables naming the dropped table
+        conn.execute(db.text("PRAGMA legacy_alter_table = ON"))
+        conn.execute(db.text(f"ALTER TABLE {table}_rebuilt RENAME TO {table}"))
+        conn.execute(db.text("PRAGMA legacy_alter_table = OFF"))
+        for kind, sql in schema:
+            if kind in ('index', 'trigger'):
+                conn.execute(db.text(sql))
+
+    print(f"  ✓ Made {', '.join(columns)} of {table} table nullable")
+
+
+# Migrations must also run cleanly on a database db.create_all() built from the current models
+
+
+def available_migrations() -> List[Tuple[str, object]]:
+    """(version, module) for every migration, in order"""
+    package = importlib.import_module(VERSIONS_PACKAGE)
+    names = sorted(info.name for info in pkgutil.iter_modules(package.__path__))
+    return [(name, importlib.import_module(f'{VERSIONS_PACKAGE}.{name}')) for name in names]
+
+
+def applied_versions() -> List[str]:
+    with db.engine.begin() as conn:
+        conn.execute(db.text(SCHEMA_MIGRATIONS))
+        return [row[0] for row in conn.execute(db.text("SELECT version FROM schema_migrations ORDER BY version"))]
+
+
+def upgrade() -> List[str]:
+    """
+    Apply every pending migration, each in its own transaction
+
+    Returns:
+        List[str]: The versions applied
+    """
+    applied = set(applied_versions())
+    done = []
+    for version, module in available_migrations():
+        if version in applied:
+            continue
+
+        print(f"Applying {version}: {(module.__doc__ or '').strip()}")
+        with db.engine.begin() as conn:
+            module.upgrade(conn)
+            conn.execute(
+                db.text("INSERT INTO schema_migrations (version, applied_at) VALUES (:version, :applied_at)"),
+                {'version': version, 'applied_at': datetime.utcnow()}
+            )
+        done.append(version)
+    return done
+
+
+db_cli = AppGroup('db', help='Database schema migrations.')
+
+
+@db_cli.command('upgrade')
+def upgrade_command():
+    """Apply pending migrations."""
+    done = upgrade()
+    print(f"Applied {len(done)} migration(s)" if done else "Database is up to date")
+
+
+@db_cli.command('status')
+def status_command():
+    """List applied and pending migrations."""
+    applied = set(applied_versions())
+    for version, module in available_migrations():
+        print(f"[{'x' if version in applied else ' '}] {version}: {(module.__doc__ or '').strip()}")
+
+
+@db_cli.command('check-indexes')
+def check_indexes_command():
+    """EXPLAIN the hot queries and fail if any scans a whole table."""
+    from migrations.explain import check_query_plans
+
+    failures = 0
+    for name, uses_index, plan in check_query_plans():
+        failures += not uses_index
+        print(f"[{'ok' if uses_index else 'SCAN'}] {name}")
+        if not uses_index:
+            for line in plan:
+                print(f"       {line}")
+
+    if failures:
+        raise click.ClickException(f"{failures} hot query(ies) scan a table without an index")
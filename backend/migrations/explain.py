@@ -0,0 +1,83 @@
+"""EXPLAIN-based check that the hot queries are served by an index."""
+
+import json
+from typing import Iterator, List, Tuple
+
+from sqlalchemy import select
+
+from models import (
+    db, Cat, Bodega, Review, CatPhoto, BodegaPhoto, SavedCat, SavedBodega, RecentlyViewed
+)
+
+
+def hot_queries() -> List[Tuple[str, object]]:
+    """(name, statement) of the queries that must use an index"""
+    return [
+        ('cats of a bodega', select(Cat.id).where(Cat.bodega_id == 1, Cat.is_active == True)),
+        ('reviews of a cat', select(Review).where(Review.cat_id == 1).order_by(Review.id.desc())),
+        ('reviews of a bodega', select(Review).where(Review.bodega_id == 1).order_by(Review.id.desc())),
+        ('reviews by a user', select(Review).where(Review.user_id == 1).order_by(Review.id.desc())),
+        ('photos of a cat', select(CatPhoto).where(CatPhoto.cat_id == 1)),
+        ('photos of a bodega', select(BodegaPhoto).where(BodegaPhoto.bodega_id == 1)),
+        ('saved cats of a user', select(SavedCat).where(SavedCat.user_id == 1).order_by(SavedCat.id.desc())),
+        ('saved bodegas of a user',
+         select(SavedBodega).where(SavedBodega.user_id == 1).order_by(SavedBodega.id.desc())),
+        ('saved state of cats', select(SavedCat.cat_id).where(SavedCat.user_id == 1, SavedCat.cat_id.in_([1, 2, 3]))),
+        ('saved state of bodegas',
+         select(SavedBodega.bodega_id).where(SavedBodega.user_id == 1, SavedBodega.bodega_id.in_([1, 2, 3]))),
+        ('saves of a cat', select(SavedCat.id).where(SavedCat.cat_id == 1)),
+        ('saves of a bodega', select(SavedBodega.id).where(SavedBodega.bodega_id == 1)),
+        ('recently viewed by a user', select(RecentlyViewed).where(RecentlyViewed.user_id == 1).order_by(
+            RecentlyViewed.viewed_at.desc(), RecentlyViewed.id.desc()
+        )),
+        ('views of a cat', select(RecentlyViewed.id).where(RecentlyViewed.cat_id == 1)),
+        ('views of a bodega', select(RecentlyViewed.id).where(RecentlyViewed.bodega_id == 1)),
+        ('bodegas in a bounding box', select(Bodega.id).where(
+            Bodega.latitude.between(40.70, 40.72), Bodega.longitude.between(-74.01, -73.99)
+        )),
+        ('top rated cats', select(Cat.id).order_by(Cat.rating.desc()).limit(20)),
+    ]
+
+
+def _sqlite_plan(conn, sql: str) -> Tuple[bool, List[str]]:
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").all()
+    lines = [row[-1] for row in rows]
+    # "SCAN <table>" reads every row; "SCAN <table> USING [COVERING] INDEX" walks an index instead
+    scans = [line for line in lines if line.startswith('SCAN') and 'USING' not in line]
+    return not scans, lines
+
+
+def _postgres_plan(conn, sql: str) -> Tuple[bool, List[str]]:
+    # A scan then means no usable index, not that the planner preferred one on a small table
+    conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {sql}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    lines = []
+
+    def walk(node, depth):
+        lines.append(f"{'  ' * depth}{node['Node Type']} {node.get('Relation Name', '')}".rstrip())
+        for child in node.get('Plans', []):
+            walk(child, depth + 1)
+
+    walk(plan[0]['Plan'], 0)
+    return not any('Seq Scan' in line for line in lines), lines
+
+
+def check_query_plans() -> Iterator[Tuple[str, bool, List[str]]]:
+    """
+    EXPLAIN every hot query
+
+    Yields:
+        Tuple[str, bool, List[str]]: Query name, whether it avoids full table
+        scans, and the plan lines
+    """
+    explain = _postgres_plan if db.engine.dialect.name == 'postgresql' else _sqlite_plan
+
+    for name, statement in hot_queries():
+        sql = str(statement.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+        # SET LOCAL ends with the transaction, which is rolled back when the connection closes
+        with db.engine.connect() as conn:
+            uses_index, lines = explain(conn, sql)
+        yield name, uses_index, lines
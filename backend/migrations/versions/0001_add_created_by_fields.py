@@ -0,0 +1,8 @@
+"""Add created_by fields to cats and bodegas"""
+
+from migrations import add_column
+
+
+def upgrade(conn):
+    for table in ['cats', 'bodegas']:
+        add_column(conn, table, 'created_by', 'INTEGER REFERENCES users(id)')
@@ -0,0 +1,7 @@
+"""Add a composite (latitude, longitude) index to bodegas for bounding-box searches"""
+
+from migrations import create_index
+
+
+def upgrade(conn):
+    create_index(conn, 'ix_bodegas_latitude_longitude', 'bodegas', ['latitude', 'longitude'])
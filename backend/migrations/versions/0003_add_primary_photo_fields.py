@@ -0,0 +1,23 @@
+"""Add denormalized primary photo fields to cats and bodegas"""
+
+from migrations import add_column
+from models import db
+
+
+def upgrade(conn):
+    for table in ['cats', 'bodegas']:
+        add_column(conn, table, 'primary_photo_id', 'INTEGER')
+        add_column(conn, table, 'primary_photo_filename', 'VARCHAR(255)')
+
+    # Backfill from the primary photo rows, newest first if several are flagged
+    for table, photo_table, key in [('cats', 'cat_photos', 'cat_id'), ('bodegas', 'bodega_photos', 'bodega_id')]:
+        primary = f"""
+            FROM {photo_table} p
+            WHERE p.{key} = {table}.id AND p.is_primary
+            ORDER BY p.id DESC LIMIT 1
+        """
+        conn.execute(db.text(f"""
+            UPDATE {table} SET
+                primary_photo_id = (SELECT p.id {primary}),
+                primary_photo_filename = (SELECT p.filename {primary})
+        """))
@@ -0,0 +1,24 @@
+"""Add rating_sum to cats and bodegas and backfill the rating aggregates from reviews"""
+
+from migrations import add_column
+from models import db
+
+
+def upgrade(conn):
+    for table, key in [('cats', 'cat_id'), ('bodegas', 'bodega_id')]:
+        add_column(conn, table, 'rating_sum', 'INTEGER DEFAULT 0')
+
+        # Rows with reviews take their aggregates from the reviews
+        conn.execute(db.text(f"""
+            UPDATE {table} SET
+                rating_sum = (SELECT SUM(r.rating) FROM reviews r WHERE r.{key} = {table}.id),
+                review_count = (SELECT COUNT(*) FROM reviews r WHERE r.{key} = {table}.id),
+                rating = (SELECT AVG(r.rating) FROM reviews r WHERE r.{key} = {table}.id)
+            WHERE EXISTS (SELECT 1 FROM reviews r WHERE r.{key} = {table}.id)
+        """))
+
+        # Rows without reviews keep their existing rating and count
+        conn.execute(db.text(f"""
+            UPDATE {table} SET rating_sum = ROUND(COALESCE(rating, 0) * COALESCE(review_count, 0))
+            WHERE NOT EXISTS (SELECT 1 FROM reviews r WHERE r.{key} = {table}.id)
+        """))
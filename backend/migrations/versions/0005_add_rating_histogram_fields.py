@@ -0,0 +1,44 @@
+"""Add per-star rating counts to cats and bodegas and backfill them from reviews"""
+
+from migrations import add_column
+from models import db
+
+STARS = range(1, 6)
+
+
+def spread_ratings(review_count: int, rating_sum: int) -> dict:
+    """Star counts totalling review_count and rating_sum, using the two ratings around the average"""
+    low = min(max(rating_sum // review_count, 1), 4)
+    high_count = min(max(rating_sum - low * review_count, 0), review_count)
+    return {low: review_count - high_count, low + 1: high_count}
+
+
+def upgrade(conn):
+    for table, key in [('cats', 'cat_id'), ('bodegas', 'bodega_id')]:
+        for stars in STARS:
+            add_column(conn, table, f'rating_count_{stars}', 'INTEGER DEFAULT 0')
+
+        assignments = ', '.join(
+            f"rating_count_{stars} = (SELECT COUNT(*) FROM reviews r WHERE r.{key} = {table}.id AND r.rating = {stars})"
+            for stars in STARS
+        )
+        # Rows with reviews take their counts from the reviews
+        conn.execute(db.text(f"""
+            UPDATE {table} SET {assignments}
+            WHERE EXISTS (SELECT 1 FROM reviews r WHERE r.{key} = {table}.id)
+        """))
+
+        # Rows without reviews keep their existing rating and count, as in 0004,
+        # so their counts are spread to match them unless they already do
+        counts = ' + '.join(f'COALESCE(rating_count_{stars}, 0)' for stars in STARS)
+        rows = conn.execute(db.text(f"""
+            SELECT id, review_count, COALESCE(rating_sum, 0) FROM {table}
+            WHERE review_count > 0 AND {counts} != review_count
+              AND NOT EXISTS (SELECT 1 FROM reviews r WHERE r.{key} = {table}.id)
+        """)).all()
+        for item_id, review_count, rating_sum in rows:
+            histogram = spread_ratings(review_count, rating_sum)
+            conn.execute(
+                db.text(f"UPDATE {table} SET {', '.join(f'rating_count_{stars} = :c{stars}' for stars in STARS)} WHERE id = :id"),
+                {'id': item_id, **{f'c{stars}': histogram.get(stars, 0) for stars in STARS}}
+            )
@@ -0,0 +1,30 @@
+"""Allow one save and one review per user and item, removing existing duplicates"""
+
+from migrations import create_index
+from models import db
+
+UNIQUE_INDEXES = [
+    ('saved_cats', 'user_id', 'cat_id'),
+    ('saved_bodegas', 'user_id', 'bodega_id'),
+    ('reviews', 'user_id', 'cat_id'),
+    ('reviews', 'user_id', 'bodega_id'),
+]
+
+
+def upgrade(conn):
+    for table, user_column, item_column in UNIQUE_INDEXES:
+        # Keep the first row of each duplicate group
+        result = conn.execute(db.text(f"""
+            DELETE FROM {table}
+            WHERE {item_column} IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM {table}
+                WHERE {item_column} IS NOT NULL
+                GROUP BY {user_column}, {item_column}
+            )
+        """))
+        if result.rowcount:
+            print(f"  Removed {result.rowcount} duplicate rows from {table} table")
+            if table == 'reviews':
+                print("  Run `flask --app app reconcile-aggregates --fix` to update the rating aggregates")
+
+        create_index(conn, f'uq_{table}_{user_column}_{item_column}', table, [user_column, item_column], unique=True)
@@ -0,0 +1,23 @@
+"""Index the foreign key and filter columns used by list, detail and search queries"""
+
+from migrations import create_index
+
+INDEXES = [
+    ('ix_cats_bodega_id', 'cats', ['bodega_id']),
+    ('ix_cats_is_active', 'cats', ['is_active']),
+    ('ix_cats_rating', 'cats', ['rating']),
+    ('ix_reviews_cat_id', 'reviews', ['cat_id']),
+    ('ix_reviews_bodega_id', 'reviews', ['bodega_id']),
+    ('ix_recently_viewed_user_id_viewed_at', 'recently_viewed', ['user_id', 'viewed_at']),
+    ('ix_recently_viewed_cat_id', 'recently_viewed', ['cat_id']),
+    ('ix_recently_viewed_bodega_id', 'recently_viewed', ['bodega_id']),
+    ('ix_saved_cats_cat_id', 'saved_cats', ['cat_id']),
+    ('ix_saved_bodegas_bodega_id', 'saved_bodegas', ['bodega_id']),
+    ('ix_cat_photos_cat_id', 'cat_photos', ['cat_id']),
+    ('ix_bodega_photos_bodega_id', 'bodega_photos', ['bodega_id']),
+]
+
+
+def upgrade(conn):
+    for name, table, columns in INDEXES:
+        create_index(conn, name, table, columns)
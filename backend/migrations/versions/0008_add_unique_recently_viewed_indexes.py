@@ -0,0 +1,38 @@
+"""Keep one recently viewed row per user and item, merging existing duplicates"""
+
+from migrations import create_index
+from models import db
+
+
+def upgrade(conn):
+    for item_column in ['cat_id', 'bodega_id']:
+        # The first row of each duplicate group is kept, with the latest view time
+        duplicates = f"""
+            FROM recently_viewed
+            WHERE {item_column} IS NOT NULL
+            GROUP BY user_id, {item_column}
+            HAVING COUNT(*) > 1
+        """
+        conn.execute(db.text(f"""
+            UPDATE recently_viewed SET viewed_at = (
+                SELECT MAX(r.viewed_at) FROM recently_viewed r
+                WHERE r.user_id = recently_viewed.user_id AND r.{item_column} = recently_viewed.{item_column}
+            )
+            WHERE id IN (SELECT MIN(id) {duplicates})
+        """))
+        result = conn.execute(db.text(f"""
+            DELETE FROM recently_viewed
+            WHERE {item_column} IS NOT NULL AND id NOT IN (
+                SELECT MIN(id) FROM recently_viewed
+                WHERE {item_column} IS NOT NULL
+                GROUP BY user_id, {item_column}
+            )
+        """))
+        if result.rowcount:
+            print(f"  Removed {result.rowcount} duplicate rows from recently_viewed table")
+
+        create_index(
+            conn, f'uq_recently_viewed_user_id_{item_column}', 'recently_viewed', ['user_id', item_column], unique=True
+        )
+
+    print("  Run `flask --app app compact-recently-viewed` to trim histories to the per-user limit")
@@ -0,0 +1,8 @@
+"""Add the geocode_cache table for persistent geocoding results"""
+
+from models import GeocodeCache
+
+
+def upgrade(conn):
+    GeocodeCache.__table__.create(conn, checkfirst=True)
+    print("  ✓ Table geocode_cache")
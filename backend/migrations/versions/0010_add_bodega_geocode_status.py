@@ -0,0 +1,27 @@
+"""Geocode bodegas in the background: nullable coordinates and a geocode status"""
+
+from migrations import add_column, create_index, drop_not_null
+from models import db
+
+# Coordinates bodegas used to get when geocoding failed
+FALLBACK_LATITUDE, FALLBACK_LONGITUDE = 40.7589, -73.9851
+
+
+def upgrade(conn):
+    drop_not_null(conn, 'bodegas', ['latitude', 'longitude'])
+    add_column(conn, 'bodegas', 'geocode_status', "VARCHAR(20) NOT NULL DEFAULT 'ok'")
+    add_column(conn, 'bodegas', 'geocode_attempts', 'INTEGER DEFAULT 0')
+    add_column(conn, 'bodegas', 'geocode_next_attempt_at', 'TIMESTAMP')
+    create_index(
+        conn, 'ix_bodegas_geocode_status_geocode_next_attempt_at', 'bodegas',
+        ['geocode_status', 'geocode_next_attempt_at']
+    )
+
+    # Bodegas placed at the fallback were never geocoded; queue them again
+    result = conn.execute(db.text("""
+        UPDATE bodegas
+        SET latitude = NULL, longitude = NULL, geocode_status = 'pending', geocode_attempts = 0
+        WHERE latitude = :latitude AND longitude = :longitude
+    """), {'latitude': FALLBACK_LATITUDE, 'longitude': FALLBACK_LONGITUDE})
+    if result.rowcount:
+        print(f"  Queued {result.rowcount} bodegas at the fallback coordinates for geocoding")
@@ -27,19 +27,36 @@ class User(db.Model):
 
 class Bodega(db.Model):
     __tablename__ = 'bodegas'
+    __table_args__ = (
+        db.Index('ix_bodegas_latitude_longitude', 'latitude', 'longitude'),
+        db.Index('ix_bodegas_geocode_status_geocode_next_attempt_at', 'geocode_status', 'geocode_next_attempt_at'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(200), nullable=False)
     address = db.Column(db.String(500), nullable=False)
-    latitude = db.Column(db.Float, nullable=False)
-    longitude = db.Column(db.Float, nullable=False)
+    # Empty until the address is geocoded
+    latitude = db.Column(db.Float, nullable=True)
+    longitude = db.Column(db.Float, nullable=True)
+    geocode_status = db.Column(db.String(20), nullable=False, default='ok')  # ok, pending, failed
+    geocode_attempts = db.Column(db.Integer, default=0)
+    geocode_next_attempt_at = db.Column(db.DateTime, nullable=True)
     description = db.Column(db.Text)
     phone = db.Column(db.String(20))
     hours = db.Column(db.String(200))
     rating = db.Column(db.Float, default=0.0)
     review_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, default=0)
+    # Number of reviews giving each star rating, from 1 to 5
+    rating_count_1 = db.Column(db.Integer, default=0)
+    rating_count_2 = db.Column(db.Integer, default=0)
+    rating_count_3 = db.Column(db.Integer, default=0)
+    rating_count_4 = db.Column(db.Integer, default=0)
+    rating_count_5 = db.Column(db.Integer, default=0)
     cat_count = db.Column(db.Integer, default=0)
     is_verified = db.Column(db.Boolean, default=False)
+    primary_photo_id = db.Column(db.Integer, nullable=True)
+    primary_photo_filename = db.Column(db.String(255), nullable=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -57,7 +74,7 @@ class Cat(db.Model):
     
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
-    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=False)
+    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=False, index=True)
     description = db.Column(db.Text)
     age = db.Column(db.String(50))
     breed = db.Column(db.String(100))
@@ -66,9 +83,18 @@ class Cat(db.Model):
     color = db.Column(db.String(100))
     weight = db.Column(db.String(50))
     is_friendly = db.Column(db.Boolean, default=True)
-    is_active = db.Column(db.Boolean, default=True)
-    rating = db.Column(db.Float, default=0.0)
+    is_active = db.Column(db.Boolean, default=True, index=True)
+    rating = db.Column(db.Float, default=0.0, index=True)
     review_count = db.Column(db.Integer, default=0)
+    rating_sum = db.Column(db.Integer, default=0)
+    # Number of reviews giving each star rating, from 1 to 5
+    rating_count_1 = db.Column(db.Integer, default=0)
+    rating_count_2 = db.Column(db.Integer, default=0)
+    rating_count_3 = db.Column(db.Integer, default=0)
+    rating_count_4 = db.Column(db.Integer, default=0)
+    rating_count_5 = db.Column(db.Integer, default=0)
+    primary_photo_id = db.Column(db.Integer, nullable=True)
+    primary_photo_filename = db.Column(db.String(255), nullable=True)
     created_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -82,11 +108,16 @@ class Cat(db.Model):
 
 class Review(db.Model):
     __tablename__ = 'reviews'
+    # One review per user for each cat and for each bodega; NULLs never conflict
+    __table_args__ = (
+        db.Index('uq_reviews_user_id_cat_id', 'user_id', 'cat_id', unique=True),
+        db.Index('uq_reviews_user_id_bodega_id', 'user_id', 'bodega_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=True)
-    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=True)
+    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=True, index=True)
+    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=True, index=True)
     rating = db.Column(db.Integer, nullable=False)
     comment = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -99,7 +130,7 @@ class CatPhoto(db.Model):
     __tablename__ = 'cat_photos'
     
     id = db.Column(db.Integer, primary_key=True)
-    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=False)
+    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     caption = db.Column(db.String(500))
     is_primary = db.Column(db.Boolean, default=False)
@@ -112,7 +143,7 @@ class BodegaPhoto(db.Model):
     __tablename__ = 'bodega_photos'
     
     id = db.Column(db.Integer, primary_key=True)
-    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=False)
+    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=False, index=True)
     filename = db.Column(db.String(255), nullable=False)
     caption = db.Column(db.String(500))
     is_primary = db.Column(db.Boolean, default=False)
@@ -123,10 +154,13 @@ class BodegaPhoto(db.Model):
 
 class SavedCat(db.Model):
     __tablename__ = 'saved_cats'
+    __table_args__ = (
+        db.Index('uq_saved_cats_user_id_cat_id', 'user_id', 'cat_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=False)
+    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -137,10 +171,13 @@ class SavedCat(db.Model):
 
 class SavedBodega(db.Model):
     __tablename__ = 'saved_bodegas'
+    __table_args__ = (
+        db.Index('uq_saved_bodegas_user_id_bodega_id', 'user_id', 'bodega_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=False)
+    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -151,11 +188,17 @@ class SavedBodega(db.Model):
 
 class RecentlyViewed(db.Model):
     __tablename__ = 'recently_viewed'
+    # One row per user for each viewed cat and each viewed bodega; NULLs never conflict
+    __table_args__ = (
+        db.Index('ix_recently_viewed_user_id_viewed_at', 'user_id', 'viewed_at'),
+        db.Index('uq_recently_viewed_user_id_cat_id', 'user_id', 'cat_id', unique=True),
+        db.Index('uq_recently_viewed_user_id_bodega_id', 'user_id', 'bodega_id', unique=True),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
-    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=True)
-    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=True)
+    cat_id = db.Column(db.Integer, db.ForeignKey('cats.id'), nullable=True, index=True)
+    bodega_id = db.Column(db.Integer, db.ForeignKey('bodegas.id'), nullable=True, index=True)
     viewed_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Relationships
@@ -163,4 +206,25 @@ class RecentlyViewed(db.Model):
     bodega = db.relationship('Bodega', backref='recently_viewed', lazy=True)
     
     def __repr__(self):
-        return f'<RecentlyViewed {self.user_id}>' 
\ No newline at end of file
+        return f'<RecentlyViewed {self.user_id}>'
+
+class GeocodeCache(db.Model):
+    __tablename__ = 'geocode_cache'
+    # Forward lookups are keyed by normalized address, reverse ones by rounded coordinates
+    __table_args__ = (
+        db.Index('uq_geocode_cache_kind_key', 'kind', 'key', unique=True),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(20), nullable=False)  # forward, reverse
+    key = db.Column(db.String(500), nullable=False)
+    # False for lookups the provider found nothing for, cached to avoid asking again
+    found = db.Column(db.Boolean, nullable=False, default=True)
+    latitude = db.Column(db.Float)
+    longitude = db.Column(db.Float)
+    address = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    
+    def __repr__(self):
+        return f'<GeocodeCache {self.kind} {self.key}>'
@@ -1,11 +1,19 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
-from models import db, Bodega, Cat, BodegaPhoto, SavedBodega, RecentlyViewed, Review
+from models import db, Bodega, Cat, BodegaPhoto, SavedBodega, Review
 from marshmallow import Schema, fields, ValidationError
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import os
 from werkzeug.utils import secure_filename
-from utils.geocoding import geocode_address
+from utils.counts import bodegas_counter
+from utils.fulltext import match_bodegas
+from utils.geocode_worker import OK, PENDING
+from utils.integrity import is_unique_violation
+from utils.pagination import decode_cursor, encode_cursor, paginate_keys, paginate_list
+from utils.serializers import BODEGA_LIST_OPTIONS, BODEGA_DETAIL_OPTIONS, serialize_bodega, serialize_bodega_detail
+from utils.spatial import bodega_index, check_bbox, check_radius
+from utils.views import view_buffer
 
 bodegas_bp = Blueprint('bodegas', __name__)
 
@@ -20,108 +28,56 @@ class BodegaSchema(Schema):
 
 bodega_schema = BodegaSchema()
 
+DEFAULT_NEARBY_LIMIT = 100
+MAX_NEARBY_LIMIT = 500
+DEFAULT_BBOX_LIMIT = 200
+MAX_BBOX_LIMIT = 1000
+
 @bodegas_bp.route('/', methods=['GET'])
 def get_bodegas():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '')
         
-        query = Bodega.query
+        query = Bodega.query.options(*BODEGA_LIST_OPTIONS)
+        order = [(Bodega.id, False)]
         
         if search:
-            query = query.filter(
-                Bodega.name.ilike(f'%{search}%') |
-                Bodega.address.ilike(f'%{search}%') |
-                Bodega.description.ilike(f'%{search}%')
-            )
+            query, rank = match_bodegas(query, search)
+            if rank is not None:
+                order.insert(0, (rank, False))
         
-        bodegas = query.paginate(page=page, per_page=per_page, error_out=False)
+        # The unfiltered list total is kept in a counter instead of counted per request
+        bodegas, pagination = paginate_list(
+            query, order, request.args, counter=None if search else bodegas_counter
+        )
         
         return jsonify({
-            'bodegas': [{
-                'id': bodega.id,
-                'name': bodega.name,
-                'address': bodega.address,
-                'latitude': bodega.latitude,
-                'longitude': bodega.longitude,
-                'description': bodega.description,
-                'phone': bodega.phone,
-                'hours': bodega.hours,
-                'rating': bodega.rating,
-                'review_count': bodega.review_count,
-                'cat_count': bodega.cat_count,
-                'is_verified': bodega.is_verified,
-                'primary_photo': next((photo.filename for photo in bodega.photos if photo.is_primary), None)
-            } for bodega in bodegas.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': bodegas.total,
-                'pages': bodegas.pages
-            }
+            'bodegas': [serialize_bodega(bodega) for bodega in bodegas],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
 @bodegas_bp.route('/<int:bodega_id>', methods=['GET'])
 def get_bodega(bodega_id):
     try:
-        bodega = Bodega.query.get_or_404(bodega_id)
+        bodega = Bodega.query.options(*BODEGA_DETAIL_OPTIONS).filter_by(id=bodega_id).first_or_404()
         
         # Track recently viewed if user is authenticated
         if request.headers.get('Authorization'):
             try:
                 verify_jwt_in_request()
                 user_id = int(get_jwt_identity())
-                recently_viewed = RecentlyViewed(
-                    user_id=user_id,
-                    bodega_id=bodega_id
-                )
-                db.session.add(recently_viewed)
-                db.session.commit()
+                # Written in bulk by a background thread, outside this request
+                view_buffer.record(user_id, bodega_id=bodega_id)
             except Exception as e:
                 pass  # Ignore errors for tracking
         
         return jsonify({
-            'bodega': {
-                'id': bodega.id,
-                'name': bodega.name,
-                'address': bodega.address,
-                'latitude': bodega.latitude,
-                'longitude': bodega.longitude,
-                'description': bodega.description,
-                'phone': bodega.phone,
-                'hours': bodega.hours,
-                'rating': bodega.rating,
-                'review_count': bodega.review_count,
-                'cat_count': bodega.cat_count,
-                'is_verified': bodega.is_verified,
-                'created_by': bodega.created_by,
-                'creator_username': bodega.creator.username if bodega.creator else None,
-                'cats': [{
-                    'id': cat.id,
-                    'name': cat.name,
-                    'description': cat.description,
-                    'age': cat.age,
-                    'breed': cat.breed,
-                    'sex': cat.sex,
-                    'personality': cat.personality,
-                    'color': cat.color,
-                    'weight': cat.weight,
-                    'is_friendly': cat.is_friendly,
-                    'rating': cat.rating,
-                    'review_count': cat.review_count,
-                    'primary_photo': next((photo.filename for photo in cat.photos if photo.is_primary), None)
-                } for cat in bodega.cats if cat.is_active],
-                'photos': [{
-                    'id': photo.id,
-                    'filename': photo.filename,
-                    'caption': photo.caption,
-                    'is_primary': photo.is_primary
-                } for photo in bodega.photos]
-            }
+            'bodega': serialize_bodega_detail(bodega)
         }), 200
         
     except Exception as e:
@@ -132,18 +88,13 @@ def get_bodega(bodega_id):
 def create_bodega():
     try:
         data = request.get_json()
-        
-        # If latitude and longitude are not provided, geocode the address
-        if 'latitude' not in data or 'longitude' not in data:
-            coordinates = geocode_address(data['address'])
-            if coordinates:
-                data['latitude'], data['longitude'] = coordinates
-            else:
-                # Fallback to default NYC coordinates if geocoding fails
-                data['latitude'], data['longitude'] = 40.7589, -73.9851
-        
         validated_data = bodega_schema.load(data)
         
+        # Without coordinates the address is geocoded in the background once the bodega is saved
+        if validated_data.get('latitude') is None or validated_data.get('longitude') is None:
+            validated_data['latitude'] = validated_data['longitude'] = None
+            validated_data['geocode_status'] = PENDING
+        
         # Get current user
         user_id = int(get_jwt_identity())
         
@@ -158,7 +109,8 @@ def create_bodega():
                 'name': new_bodega.name,
                 'address': new_bodega.address,
                 'latitude': new_bodega.latitude,
-                'longitude': new_bodega.longitude
+                'longitude': new_bodega.longitude,
+                'geocode_status': new_bodega.geocode_status
             }
         }), 201
         
@@ -180,12 +132,26 @@ def update_bodega(bodega_id):
             return jsonify({'error': 'Unauthorized: You can only edit bodegas you created'}), 403
         
         data = request.get_json()
+        address_changed = 'address' in data and data['address'] != bodega.address
         
         # Update fields
         for field, value in data.items():
-            if hasattr(bodega, field) and field not in ['id', 'created_by', 'created_at']:
+            if hasattr(bodega, field) and field not in [
+                'id', 'created_by', 'created_at', 'geocode_status', 'geocode_attempts', 'geocode_next_attempt_at'
+            ]:
                 setattr(bodega, field, value)
         
+        if address_changed and ('latitude' not in data or 'longitude' not in data):
+            # A new address without coordinates is geocoded again in the background
+            bodega.latitude = bodega.longitude = None
+            bodega.geocode_status = PENDING
+            bodega.geocode_attempts = 0
+            bodega.geocode_next_attempt_at = None
+        elif bodega.latitude is not None and bodega.longitude is not None and bodega.geocode_status != OK:
+            # Coordinates set by hand settle a pending or failed geocode
+            bodega.geocode_status = OK
+            bodega.geocode_next_attempt_at = None
+        
         db.session.commit()
         
         return jsonify({
@@ -249,14 +215,17 @@ def save_bodega(bodega_id):
     try:
         user_id = int(get_jwt_identity())
         
-        # Check if already saved
-        existing = SavedBodega.query.filter_by(user_id=user_id, bodega_id=bodega_id).first()
-        if existing:
-            return jsonify({'error': 'Bodega already saved'}), 400
-        
         saved_bodega = SavedBodega(user_id=user_id, bodega_id=bodega_id)
         db.session.add(saved_bodega)
-        db.session.commit()
+        
+        # The unique (user_id, bodega_id) index rejects a second save
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if is_unique_violation(e):
+                return jsonify({'error': 'Bodega already saved'}), 400
+            raise
         
         return jsonify({'message': 'Bodega saved successfully'}), 200
         
@@ -286,27 +255,13 @@ def unsave_bodega(bodega_id):
 @bodegas_bp.route('/random', methods=['GET'])
 def get_random_bodega():
     try:
-        bodega = Bodega.query.order_by(func.random()).first()
+        bodega = Bodega.query.options(*BODEGA_LIST_OPTIONS).order_by(func.random()).first()
         
         if not bodega:
             return jsonify({'error': 'No bodegas found'}), 404
         
         return jsonify({
-            'bodega': {
-                'id': bodega.id,
-                'name': bodega.name,
-                'address': bodega.address,
-                'latitude': bodega.latitude,
-                'longitude': bodega.longitude,
-                'description': bodega.description,
-                'phone': bodega.phone,
-                'hours': bodega.hours,
-                'rating': bodega.rating,
-                'review_count': bodega.review_count,
-                'cat_count': bodega.cat_count,
-                'is_verified': bodega.is_verified,
-                'primary_photo': next((photo.filename for photo in bodega.photos if photo.is_primary), None)
-            }
+            'bodega': serialize_bodega(bodega)
         }), 200
         
     except Exception as e:
@@ -318,54 +273,98 @@ def get_nearby_bodegas():
         lat = request.args.get('lat', type=float)
         lng = request.args.get('lng', type=float)
         radius = request.args.get('radius', 5.0, type=float)  # Default 5km radius
+        limit = min(request.args.get('limit', DEFAULT_NEARBY_LIMIT, type=int), MAX_NEARBY_LIMIT)
+        cursor = request.args.get('after')
         
         if not lat or not lng:
             return jsonify({'error': 'Latitude and longitude are required'}), 400
         
-        # Simple distance calculation (for production, use PostGIS or similar)
-        from math import radians, cos, sin, asin, sqrt
-        
-        def haversine_distance(lat1, lon1, lat2, lon2):
-            R = 6371  # Earth's radius in kilometers
-            
-            lat1, lon1, lat2, lon2 = map(radians, [lat1, lon1, lat2, lon2])
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            
-            a = sin(dlat/2)**2 + cos(lat1) * cos(lat2) * sin(dlon/2)**2
-            c = 2 * asin(sqrt(a))
-            distance = R * c
-            
-            return distance
-        
-        bodegas = Bodega.query.all()
+        if limit < 1:
+            return jsonify({'error': 'Limit must be positive'}), 400
+        
+        check_radius(radius)
+        
+        # Bodegas within the radius, nearest first. The first page only needs
+        # one extra match to know whether another page follows.
+        matches = bodega_index.nearby(lat, lng, radius, limit=None if cursor else limit + 1)
+        keys = [(distance, bodega_id) for bodega_id, distance in matches]
+        page, next_cursor = paginate_keys(keys, cursor, limit)
+        
+        bodegas = {bodega.id: bodega for bodega in Bodega.query.options(*BODEGA_LIST_OPTIONS).filter(
+            Bodega.id.in_([bodega_id for _, bodega_id in page])
+        )} if page else {}
         nearby_bodegas = []
         
-        for bodega in bodegas:
-            distance = haversine_distance(lat, lng, bodega.latitude, bodega.longitude)
-            if distance <= radius:
-                nearby_bodegas.append({
-                    'id': bodega.id,
-                    'name': bodega.name,
-                    'address': bodega.address,
-                    'latitude': bodega.latitude,
-                    'longitude': bodega.longitude,
-                    'description': bodega.description,
-                    'rating': bodega.rating,
-                    'review_count': bodega.review_count,
-                    'cat_count': bodega.cat_count,
-                    'distance': round(distance, 2),
-                    'primary_photo': next((photo.filename for photo in bodega.photos if photo.is_primary), None)
-                })
-        
-        # Sort by distance
-        nearby_bodegas.sort(key=lambda x: x['distance'])
+        for distance, bodega_id in page:
+            bodega = bodegas.get(bodega_id)
+            if not bodega:
+                continue
+            nearby_bodegas.append(serialize_bodega(bodega, distance=round(distance, 2)))
         
         return jsonify({
             'bodegas': nearby_bodegas,
             'search_location': {'lat': lat, 'lng': lng},
-            'radius': radius
+            'radius': radius,
+            'pagination': {
+                'limit': limit,
+                'next_cursor': next_cursor
+            }
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Internal server error'}), 500
+
+@bodegas_bp.route('/in-bbox', methods=['GET'])
+def get_bodegas_in_bbox():
+    try:
+        min_lat, min_lng, max_lat, max_lng = check_bbox(
+            request.args.get('min_lat', type=float),
+            request.args.get('min_lng', type=float),
+            request.args.get('max_lat', type=float),
+            request.args.get('max_lng', type=float)
+        )
+        limit = min(request.args.get('limit', DEFAULT_BBOX_LIMIT, type=int), MAX_BBOX_LIMIT)
+        after = decode_cursor(request.args.get('after'), 1)
+        
+        if limit < 1:
+            return jsonify({'error': 'Limit must be positive'}), 400
+        
+        if after and not isinstance(after[0], int):
+            raise ValueError("Invalid cursor")
+        
+        # Marker columns only, over the (latitude, longitude) index, in id order
+        query = db.session.query(
+            Bodega.id, Bodega.latitude, Bodega.longitude, Bodega.cat_count,
+            Bodega.rating, Bodega.primary_photo_filename
+        ).filter(
+            Bodega.latitude.between(min_lat, max_lat),
+            Bodega.longitude.between(min_lng, max_lng)
+        )
+        if after:
+            query = query.filter(Bodega.id > after[0])
+        rows = query.order_by(Bodega.id).limit(limit + 1).all()
+        
+        page = rows[:limit]
+        next_cursor = encode_cursor([page[-1].id]) if len(rows) > limit else None
+        
+        return jsonify({
+            'bodegas': [{
+                'id': row.id,
+                'latitude': row.latitude,
+                'longitude': row.longitude,
+                'cat_count': row.cat_count,
+                'rating': row.rating,
+                'primary_photo': row.primary_photo_filename
+            } for row in page],
+            'pagination': {
+                'limit': limit,
+                'next_cursor': next_cursor
+            }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500 
\ No newline at end of file
@@ -1,11 +1,18 @@
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity, verify_jwt_in_request
-from models import db, Cat, Bodega, CatPhoto, SavedCat, RecentlyViewed, Review
+from models import db, Cat, Bodega, CatPhoto, SavedCat, Review
 from marshmallow import Schema, fields, ValidationError
 from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import os
 from werkzeug.utils import secure_filename
-from utils.geocoding import geocode_address
+from utils.counts import active_cats_counter
+from utils.fulltext import match_cats
+from utils.geocode_worker import PENDING
+from utils.integrity import is_unique_violation
+from utils.pagination import paginate_list
+from utils.serializers import CAT_LIST_OPTIONS, CAT_DETAIL_OPTIONS, serialize_cat, serialize_cat_detail
+from utils.views import view_buffer
 
 cats_bp = Blueprint('cats', __name__)
 
@@ -26,98 +33,48 @@ cat_schema = CatSchema()
 @cats_bp.route('/', methods=['GET'])
 def get_cats():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('search', '')
         
-        query = Cat.query.filter(Cat.is_active == True)
+        query = Cat.query.options(*CAT_LIST_OPTIONS).filter(Cat.is_active == True)
+        order = [(Cat.id, False)]
         
         if search:
-            query = query.filter(
-                Cat.name.ilike(f'%{search}%') |
-                Cat.description.ilike(f'%{search}%') |
-                Cat.breed.ilike(f'%{search}%')
-            )
+            query, rank = match_cats(query, search)
+            if rank is not None:
+                order.insert(0, (rank, False))
         
-        cats = query.paginate(page=page, per_page=per_page, error_out=False)
+        # The unfiltered list total is kept in a counter instead of counted per request
+        cats, pagination = paginate_list(
+            query, order, request.args, counter=None if search else active_cats_counter
+        )
         
         return jsonify({
-            'cats': [{
-                'id': cat.id,
-                'name': cat.name,
-                'bodega_id': cat.bodega_id,
-                'bodega_name': cat.bodega.name,
-                'address': cat.bodega.address,
-                'description': cat.description,
-                'age': cat.age,
-                'breed': cat.breed,
-                'sex': cat.sex,
-                'personality': cat.personality,
-                'color': cat.color,
-                'weight': cat.weight,
-                'is_friendly': cat.is_friendly,
-                'rating': cat.rating,
-                'review_count': cat.review_count,
-                'primary_photo': next((photo.filename for photo in cat.photos if photo.is_primary), None)
-            } for cat in cats.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': cats.total,
-                'pages': cats.pages
-            }
+            'cats': [serialize_cat(cat) for cat in cats],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
 @cats_bp.route('/<int:cat_id>', methods=['GET'])
 def get_cat(cat_id):
     try:
-        cat = Cat.query.get_or_404(cat_id)
+        cat = Cat.query.options(*CAT_DETAIL_OPTIONS).filter_by(id=cat_id).first_or_404()
         
         # Track recently viewed if user is authenticated
         if request.headers.get('Authorization'):
             try:
                 verify_jwt_in_request()
                 user_id = int(get_jwt_identity())
-                recently_viewed = RecentlyViewed(
-                    user_id=user_id,
-                    cat_id=cat_id
-                )
-                db.session.add(recently_viewed)
-                db.session.commit()
+                # Written in bulk by a background thread, outside this request
+                view_buffer.record(user_id, cat_id=cat_id)
             except Exception as e:
                 pass  # Ignore errors for tracking
         
         return jsonify({
-            'cat': {
-                'id': cat.id,
-                'name': cat.name,
-                'bodega_id': cat.bodega_id,
-                'bodega_name': cat.bodega.name,
-                'address': cat.bodega.address,
-                'latitude': cat.bodega.latitude,
-                'longitude': cat.bodega.longitude,
-                'description': cat.description,
-                'age': cat.age,
-                'breed': cat.breed,
-                'sex': cat.sex,
-                'personality': cat.personality,
-                'color': cat.color,
-                'weight': cat.weight,
-                'is_friendly': cat.is_friendly,
-                'rating': cat.rating,
-                'review_count': cat.review_count,
-                'created_by': cat.created_by,
-                'creator_username': cat.creator.username if cat.creator else None,
-                'photos': [{
-                    'id': photo.id,
-                    'filename': photo.filename,
-                    'caption': photo.caption,
-                    'is_primary': photo.is_primary
-                } for photo in cat.photos]
-            }
+            'cat': serialize_cat_detail(cat)
         }), 200
         
     except Exception as e:
@@ -138,25 +95,20 @@ def create_cat():
             ).first()
             
             if not bodega:
-                # Geocode the address to get coordinates
-                coordinates = geocode_address(data['address'])
-                if coordinates:
-                    latitude, longitude = coordinates
-                else:
-                    # Fallback to default NYC coordinates if geocoding fails
-                    latitude, longitude = 40.7589, -73.9851
-                
-                # Create new bodega
+                # Create new bodega; its address is geocoded in the background once saved
                 bodega = Bodega(
                     name=data['bodega_name'],
                     address=data['address'],
                     description=data.get('bodega_description', ''),
-                    latitude=latitude,
-                    longitude=longitude,
+                    geocode_status=PENDING,
                     cat_count=1
                 )
                 db.session.add(bodega)
                 db.session.flush()  # Get the ID without committing
+        else:
+            bodega = db.session.get(Bodega, data.get('bodega_id'))
+            if not bodega:
+                return jsonify({'error': 'Bodega not found'}), 404
         
         # Prepare cat data
         cat_data = {
@@ -279,14 +231,17 @@ def save_cat(cat_id):
     try:
         user_id = int(get_jwt_identity())
         
-        # Check if already saved
-        existing = SavedCat.query.filter_by(user_id=user_id, cat_id=cat_id).first()
-        if existing:
-            return jsonify({'error': 'Cat already saved'}), 400
-        
         saved_cat = SavedCat(user_id=user_id, cat_id=cat_id)
         db.session.add(saved_cat)
-        db.session.commit()
+        
+        # The unique (user_id, cat_id) index rejects a second save
+        try:
+            db.session.commit()
+        except IntegrityError as e:
+            db.session.rollback()
+            if is_unique_violation(e):
+                return jsonify({'error': 'Cat already saved'}), 400
+            raise
         
         return jsonify({'message': 'Cat saved successfully'}), 200
         
@@ -316,30 +271,13 @@ def unsave_cat(cat_id):
 @cats_bp.route('/random', methods=['GET'])
 def get_random_cat():
     try:
-        cat = Cat.query.filter(Cat.is_active == True).order_by(func.random()).first()
+        cat = Cat.query.options(*CAT_LIST_OPTIONS).filter(Cat.is_active == True).order_by(func.random()).first()
         
         if not cat:
             return jsonify({'error': 'No cats found'}), 404
         
         return jsonify({
-            'cat': {
-                'id': cat.id,
-                'name': cat.name,
-                'bodega_id': cat.bodega_id,
-                'bodega_name': cat.bodega.name,
-                'address': cat.bodega.address,
-                'description': cat.description,
-                'age': cat.age,
-                'breed': cat.breed,
-                'sex': cat.sex,
-                'personality': cat.personality,
-                'color': cat.color,
-                'weight': cat.weight,
-                'is_friendly': cat.is_friendly,
-                'rating': cat.rating,
-                'review_count': cat.review_count,
-                'primary_photo': next((photo.filename for photo in cat.photos if photo.is_primary), None)
-            }
+            'cat': serialize_cat(cat)
         }), 200
         
     except Exception as e:
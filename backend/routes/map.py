@@ -0,0 +1,33 @@
+from flask import Blueprint, request, jsonify
+from utils.clusters import MAX_ZOOM, cluster_cache, tile_count
+from utils.spatial import parse_bbox
+
+map_bp = Blueprint('map', __name__)
+
+# Largest number of tiles a single request may cover
+MAX_TILES_PER_REQUEST = 64
+
+@map_bp.route('/clusters', methods=['GET'])
+def get_clusters():
+    try:
+        min_lat, min_lng, max_lat, max_lng = parse_bbox(request.args.get('bbox'))
+        zoom = request.args.get('zoom', type=int)
+        
+        if zoom is None or not 0 <= zoom <= MAX_ZOOM:
+            return jsonify({'error': f'zoom must be an integer between 0 and {MAX_ZOOM}'}), 400
+        
+        # Count the tiles from the corners before anything lists them
+        if tile_count(min_lat, min_lng, max_lat, max_lng, zoom) > MAX_TILES_PER_REQUEST:
+            return jsonify({'error': 'bbox is too large for this zoom level'}), 400
+        
+        clusters = cluster_cache.clusters(min_lat, min_lng, max_lat, max_lng, zoom)
+        
+        return jsonify({
+            'zoom': zoom,
+            'clusters': clusters
+        }), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Internal server error'}), 500
@@ -15,6 +15,17 @@ def allowed_file(filename):
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def replace_primary_photo(owner, deleted_photo):
+    """Point a cat or bodega at its next primary photo once deleted_photo is removed"""
+    # Prefer another photo still flagged primary, then the newest one
+    remaining = [photo for photo in owner.photos if photo.id != deleted_photo.id]
+    successor = max(remaining, key=lambda photo: (bool(photo.is_primary), photo.id), default=None)
+    
+    if successor is not None:
+        successor.is_primary = True
+    owner.primary_photo_id = successor.id if successor else None
+    owner.primary_photo_filename = successor.filename if successor else None
+
 def save_file(file, folder):
     """Save uploaded file with unique filename"""
     if file and allowed_file(file.filename):
@@ -72,6 +83,12 @@ def upload_cat_photo(cat_id):
         )
         
         db.session.add(photo)
+        
+        if is_primary:
+            db.session.flush()  # Assign the photo id
+            cat.primary_photo_id = photo.id
+            cat.primary_photo_filename = photo.filename
+        
         db.session.commit()
         
         return jsonify({
@@ -129,6 +146,12 @@ def upload_bodega_photo(bodega_id):
         )
         
         db.session.add(photo)
+        
+        if is_primary:
+            db.session.flush()  # Assign the photo id
+            bodega.primary_photo_id = photo.id
+            bodega.primary_photo_filename = photo.filename
+        
         db.session.commit()
         
         return jsonify({
@@ -165,6 +188,9 @@ def delete_cat_photo(cat_id, photo_id):
             os.remove(file_path)
         
         # Delete from database
+        if cat.primary_photo_id == photo.id:
+            replace_primary_photo(cat, photo)
+        
         db.session.delete(photo)
         db.session.commit()
         
@@ -193,6 +219,9 @@ def delete_bodega_photo(bodega_id, photo_id):
             os.remove(file_path)
         
         # Delete from database
+        if bodega.primary_photo_id == photo.id:
+            replace_primary_photo(bodega, photo)
+        
         db.session.delete(photo)
         db.session.commit()
         
@@ -220,6 +249,8 @@ def set_cat_primary_photo(cat_id, photo_id):
         
         # Mark this photo as primary
         photo.is_primary = True
+        cat.primary_photo_id = photo.id
+        cat.primary_photo_filename = photo.filename
         db.session.commit()
         
         return jsonify({'message': 'Primary photo updated successfully'}), 200
@@ -246,6 +277,8 @@ def set_bodega_primary_photo(bodega_id, photo_id):
         
         # Mark this photo as primary
         photo.is_primary = True
+        bodega.primary_photo_id = photo.id
+        bodega.primary_photo_filename = photo.filename
         db.session.commit()
         
         return jsonify({'message': 'Primary photo updated successfully'}), 200
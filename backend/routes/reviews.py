@@ -1,8 +1,13 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from models import db, Review, Cat, Bodega, User
-from marshmallow import Schema, fields, ValidationError
-from sqlalchemy import func
+from models import db, Review
+from marshmallow import EXCLUDE, Schema, fields, ValidationError
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from utils.integrity import is_unique_violation
+from utils.pagination import paginate_list
+from utils.ratings import apply_review_change
+from utils.serializers import REVIEW_LIST_OPTIONS, USER_REVIEW_LIST_OPTIONS, serialize_review, serialize_user_review
 
 reviews_bp = Blueprint('reviews', __name__)
 
@@ -13,6 +18,10 @@ class ReviewSchema(Schema):
     bodega_id = fields.Int()
 
 review_schema = ReviewSchema()
+review_update_schema = ReviewSchema(partial=True, only=('rating', 'comment'), unknown=EXCLUDE)
+
+# Attempts to swap a rating before giving up on a review being changed concurrently
+MAX_RATING_SWAPS = 3
 
 @reviews_bp.route('/', methods=['POST'])
 @jwt_required()
@@ -29,39 +38,25 @@ def create_review():
         if validated_data.get('cat_id') and validated_data.get('bodega_id'):
             return jsonify({'error': 'Cannot review both cat and bodega in the same review'}), 400
         
-        # Check if user already reviewed this cat/bodega
-        existing_review = Review.query.filter_by(
-            user_id=user_id,
-            cat_id=validated_data.get('cat_id'),
-            bodega_id=validated_data.get('bodega_id')
-        ).first()
-        
-        if existing_review:
-            return jsonify({'error': 'You have already reviewed this item'}), 400
-        
         # Create new review
         new_review = Review(
             user_id=user_id,
             **validated_data
         )
         
-        db.session.add(new_review)
-        db.session.commit()
+        # The unique (user_id, cat_id) and (user_id, bodega_id) indexes reject a
+        # second review of the same item when the review is flushed
+        try:
+            db.session.add(new_review)
+            db.session.flush()
+        except IntegrityError as e:
+            db.session.rollback()
+            if is_unique_violation(e):
+                return jsonify({'error': 'You have already reviewed this item'}), 400
+            raise
         
-        # Update rating statistics
-        if validated_data.get('cat_id'):
-            cat = Cat.query.get(validated_data['cat_id'])
-            if cat:
-                cat_reviews = Review.query.filter_by(cat_id=cat.id).all()
-                cat.rating = sum(r.rating for r in cat_reviews) / len(cat_reviews)
-                cat.review_count = len(cat_reviews)
-        
-        if validated_data.get('bodega_id'):
-            bodega = Bodega.query.get(validated_data['bodega_id'])
-            if bodega:
-                bodega_reviews = Review.query.filter_by(bodega_id=bodega.id).all()
-                bodega.rating = sum(r.rating for r in bodega_reviews) / len(bodega_reviews)
-                bodega.review_count = len(bodega_reviews)
+        # Update rating statistics in the same transaction
+        apply_review_change(new_review.cat_id, new_review.bodega_id, added=new_review.rating)
         
         db.session.commit()
         
@@ -94,33 +89,29 @@ def update_review(review_id):
         if review.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        data = request.get_json()
+        validated_data = review_update_schema.load(request.get_json() or {})
         
         # Update fields
-        if 'rating' in data:
-            if not 1 <= data['rating'] <= 5:
-                return jsonify({'error': 'Rating must be between 1 and 5'}), 400
-            review.rating = data['rating']
-        
-        if 'comment' in data:
-            review.comment = data['comment']
-        
-        db.session.commit()
-        
-        # Update rating statistics
-        if review.cat_id:
-            cat = Cat.query.get(review.cat_id)
-            if cat:
-                cat_reviews = Review.query.filter_by(cat_id=cat.id).all()
-                cat.rating = sum(r.rating for r in cat_reviews) / len(cat_reviews)
-                cat.review_count = len(cat_reviews)
-        
-        if review.bodega_id:
-            bodega = Bodega.query.get(review.bodega_id)
-            if bodega:
-                bodega_reviews = Review.query.filter_by(bodega_id=bodega.id).all()
-                bodega.rating = sum(r.rating for r in bodega_reviews) / len(bodega_reviews)
-                bodega.review_count = len(bodega_reviews)
+        if 'rating' in validated_data:
+            # Swap the rating only if the row still holds the one read, so the
+            # aggregates lose exactly the rating that was replaced
+            for _ in range(MAX_RATING_SWAPS):
+                old_rating = review.rating
+                swapped = db.session.execute(
+                    update(Review).where(Review.id == review.id, Review.rating == old_rating)
+                    .values(rating=validated_data['rating'])
+                ).rowcount
+                if swapped:
+                    break
+                db.session.refresh(review)
+            else:
+                raise RuntimeError(f"Review {review.id} kept changing while its rating was updated")
+            
+            # Update rating statistics in the same transaction
+            apply_review_change(review.cat_id, review.bodega_id, removed=old_rating, added=validated_data['rating'])
+        
+        if 'comment' in validated_data:
+            review.comment = validated_data['comment']
         
         db.session.commit()
         
@@ -136,6 +127,8 @@ def update_review(review_id):
             }
         }), 200
         
+    except ValidationError as e:
+        return jsonify({'error': 'Validation error', 'details': e.messages}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': 'Internal server error'}), 500
@@ -151,34 +144,10 @@ def delete_review(review_id):
         if review.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
-        cat_id = review.cat_id
-        bodega_id = review.bodega_id
-        
         db.session.delete(review)
-        db.session.commit()
         
-        # Update rating statistics
-        if cat_id:
-            cat = Cat.query.get(cat_id)
-            if cat:
-                cat_reviews = Review.query.filter_by(cat_id=cat.id).all()
-                if cat_reviews:
-                    cat.rating = sum(r.rating for r in cat_reviews) / len(cat_reviews)
-                    cat.review_count = len(cat_reviews)
-                else:
-                    cat.rating = 0
-                    cat.review_count = 0
-        
-        if bodega_id:
-            bodega = Bodega.query.get(bodega_id)
-            if bodega:
-                bodega_reviews = Review.query.filter_by(bodega_id=bodega.id).all()
-                if bodega_reviews:
-                    bodega.rating = sum(r.rating for r in bodega_reviews) / len(bodega_reviews)
-                    bodega.review_count = len(bodega_reviews)
-                else:
-                    bodega.rating = 0
-                    bodega.review_count = 0
+        # Update rating statistics in the same transaction
+        apply_review_change(review.cat_id, review.bodega_id, removed=review.rating)
         
         db.session.commit()
         
@@ -191,66 +160,42 @@ def delete_review(review_id):
 @reviews_bp.route('/cat/<int:cat_id>', methods=['GET'])
 def get_cat_reviews(cat_id):
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        
-        reviews = Review.query.filter_by(cat_id=cat_id).paginate(
-            page=page, per_page=per_page, error_out=False
+        # Newest first
+        reviews, pagination = paginate_list(
+            Review.query.options(*REVIEW_LIST_OPTIONS).filter_by(cat_id=cat_id),
+            [(Review.id, True)],
+            request.args,
+            default_per_page=10
         )
         
         return jsonify({
-            'reviews': [{
-                'id': review.id,
-                'rating': review.rating,
-                'comment': review.comment,
-                'user': {
-                    'id': review.user.id,
-                    'username': review.user.username
-                },
-                'created_at': review.created_at.isoformat(),
-                'updated_at': review.updated_at.isoformat()
-            } for review in reviews.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': reviews.total,
-                'pages': reviews.pages
-            }
+            'reviews': [serialize_review(review) for review in reviews],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
 @reviews_bp.route('/bodega/<int:bodega_id>', methods=['GET'])
 def get_bodega_reviews(bodega_id):
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        
-        reviews = Review.query.filter_by(bodega_id=bodega_id).paginate(
-            page=page, per_page=per_page, error_out=False
+        # Newest first
+        reviews, pagination = paginate_list(
+            Review.query.options(*REVIEW_LIST_OPTIONS).filter_by(bodega_id=bodega_id),
+            [(Review.id, True)],
+            request.args,
+            default_per_page=10
         )
         
         return jsonify({
-            'reviews': [{
-                'id': review.id,
-                'rating': review.rating,
-                'comment': review.comment,
-                'user': {
-                    'id': review.user.id,
-                    'username': review.user.username
-                },
-                'created_at': review.created_at.isoformat(),
-                'updated_at': review.updated_at.isoformat()
-            } for review in reviews.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': reviews.total,
-                'pages': reviews.pages
-            }
+            'reviews': [serialize_review(review) for review in reviews],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
@@ -259,36 +204,20 @@ def get_bodega_reviews(bodega_id):
 def get_user_reviews():
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        
-        reviews = Review.query.filter_by(user_id=user_id).paginate(
-            page=page, per_page=per_page, error_out=False
+        # Newest first
+        reviews, pagination = paginate_list(
+            Review.query.options(*USER_REVIEW_LIST_OPTIONS).filter_by(user_id=user_id),
+            [(Review.id, True)],
+            request.args,
+            default_per_page=10
         )
         
         return jsonify({
-            'reviews': [{
-                'id': review.id,
-                'rating': review.rating,
-                'comment': review.comment,
-                'cat': {
-                    'id': review.cat.id,
-                    'name': review.cat.name
-                } if review.cat else None,
-                'bodega': {
-                    'id': review.bodega.id,
-                    'name': review.bodega.name
-                } if review.bodega else None,
-                'created_at': review.created_at.isoformat(),
-                'updated_at': review.updated_at.isoformat()
-            } for review in reviews.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': reviews.total,
-                'pages': reviews.pages
-            }
+            'reviews': [serialize_user_review(review) for review in reviews],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500 
\ No newline at end of file
@@ -1,36 +1,45 @@
 from flask import Blueprint, request, jsonify
 from models import db, Cat, Bodega, Review
 from sqlalchemy import func, and_, or_
-import math
+from utils.counts import active_cats_counter, bodegas_counter
+from utils.fulltext import match_cats, match_bodegas
+from utils.pagination import paginate_keys, paginate_list
+from utils.ratings import bayesian_score
+from utils.serializers import CAT_LIST_OPTIONS, BODEGA_LIST_OPTIONS, serialize_cat, serialize_bodega
+from utils.spatial import MAX_SEARCH_RADIUS, bodega_index, check_radius
+from utils.suggest import suggestion_index
+import heapq
 
 search_bp = Blueprint('search', __name__)
 
+SORTS = ('relevance', 'score')
+
 @search_bp.route('/cats', methods=['GET'])
 def search_cats():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('q', '')
         breed = request.args.get('breed', '')
         personality = request.args.get('personality', '')
         min_rating = request.args.get('min_rating', 0, type=float)
         max_rating = request.args.get('max_rating', 5, type=float)
         is_friendly = request.args.get('is_friendly', type=lambda v: v.lower() == 'true')
+        sort = request.args.get('sort', 'relevance')
+        
+        if sort not in SORTS:
+            return jsonify({'error': 'sort must be one of: ' + ', '.join(SORTS)}), 400
         
-        query = Cat.query.filter(Cat.is_active == True)
+        query = Cat.query.options(*CAT_LIST_OPTIONS).filter(Cat.is_active == True)
+        order = [(Cat.id, False)]
         
-        # Text search
+        # Text search, best matches first
         if search:
-            query = query.filter(
-                or_(
-                    Cat.name.ilike(f'%{search}%'),
-                    Cat.description.ilike(f'%{search}%'),
-                    Cat.breed.ilike(f'%{search}%'),
-                    Cat.personality.ilike(f'%{search}%'),
-                    Cat.bodega.has(Bodega.name.ilike(f'%{search}%')),
-                    Cat.bodega.has(Bodega.address.ilike(f'%{search}%'))
-                )
-            )
+            query, rank = match_cats(query, search, include_bodega=True)
+            if rank is not None:
+                order.insert(0, (rank, False))
+        
+        # Bayesian-weighted rating, highest first, read from the stored aggregates
+        if sort == 'score':
+            order = [(bayesian_score(Cat), True), (Cat.id, False)]
         
         # Filters
         if breed:
@@ -48,71 +57,56 @@ def search_cats():
         if is_friendly is not None:
             query = query.filter(Cat.is_friendly == is_friendly)
         
-        cats = query.paginate(page=page, per_page=per_page, error_out=False)
+        filtered = search or breed or personality or min_rating > 0 or max_rating < 5 or is_friendly is not None
+        cats, pagination = paginate_list(
+            query, order, request.args, counter=None if filtered else active_cats_counter
+        )
         
         return jsonify({
-            'cats': [{
-                'id': cat.id,
-                'name': cat.name,
-                'bodega_id': cat.bodega_id,
-                'bodega_name': cat.bodega.name,
-                'address': cat.bodega.address,
-                'latitude': cat.bodega.latitude,
-                'longitude': cat.bodega.longitude,
-                'description': cat.description,
-                'age': cat.age,
-                'breed': cat.breed,
-                'sex': cat.sex,
-                'personality': cat.personality,
-                'color': cat.color,
-                'weight': cat.weight,
-                'is_friendly': cat.is_friendly,
-                'rating': cat.rating,
-                'review_count': cat.review_count,
-                'primary_photo': next((photo.filename for photo in cat.photos if photo.is_primary), None)
-            } for cat in cats.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': cats.total,
-                'pages': cats.pages
-            },
+            'cats': [serialize_cat(cat) for cat in cats],
+            'pagination': pagination,
             'filters': {
                 'search': search,
                 'breed': breed,
                 'personality': personality,
                 'min_rating': min_rating,
                 'max_rating': max_rating,
-                'is_friendly': is_friendly
+                'is_friendly': is_friendly,
+                'sort': sort
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
 @search_bp.route('/bodegas', methods=['GET'])
 def search_bodegas():
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         search = request.args.get('q', '')
         min_cats = request.args.get('min_cats', 0, type=int)
         max_cats = request.args.get('max_cats', 100, type=int)
         min_rating = request.args.get('min_rating', 0, type=float)
         max_rating = request.args.get('max_rating', 5, type=float)
         verified_only = request.args.get('verified_only', type=lambda v: v.lower() == 'true')
+        sort = request.args.get('sort', 'relevance')
         
-        query = Bodega.query
+        if sort not in SORTS:
+            return jsonify({'error': 'sort must be one of: ' + ', '.join(SORTS)}), 400
         
-        # Text search
+        query = Bodega.query.options(*BODEGA_LIST_OPTIONS)
+        order = [(Bodega.id, False)]
+        
+        # Text search, best matches first
         if search:
-            query = query.filter(
-                or_(
-                    Bodega.name.ilike(f'%{search}%'),
-                    Bodega.address.ilike(f'%{search}%'),
-                    Bodega.description.ilike(f'%{search}%')
-                )
-            )
+            query, rank = match_bodegas(query, search)
+            if rank is not None:
+                order.insert(0, (rank, False))
+        
+        # Bayesian-weighted rating, highest first, read from the stored aggregates
+        if sort == 'score':
+            order = [(bayesian_score(Bodega), True), (Bodega.id, False)]
         
         # Filters
         if min_cats > 0:
@@ -130,43 +124,62 @@ def search_bodegas():
         if verified_only:
             query = query.filter(Bodega.is_verified == True)
         
-        bodegas = query.paginate(page=page, per_page=per_page, error_out=False)
+        filtered = search or min_cats > 0 or max_cats < 100 or min_rating > 0 or max_rating < 5 or verified_only
+        bodegas, pagination = paginate_list(
+            query, order, request.args, counter=None if filtered else bodegas_counter
+        )
         
         return jsonify({
-            'bodegas': [{
-                'id': bodega.id,
-                'name': bodega.name,
-                'address': bodega.address,
-                'latitude': bodega.latitude,
-                'longitude': bodega.longitude,
-                'description': bodega.description,
-                'phone': bodega.phone,
-                'hours': bodega.hours,
-                'rating': bodega.rating,
-                'review_count': bodega.review_count,
-                'cat_count': bodega.cat_count,
-                'is_verified': bodega.is_verified,
-                'primary_photo': next((photo.filename for photo in bodega.photos if photo.is_primary), None)
-            } for bodega in bodegas.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': bodegas.total,
-                'pages': bodegas.pages
-            },
+            'bodegas': [serialize_bodega(bodega) for bodega in bodegas],
+            'pagination': pagination,
             'filters': {
                 'search': search,
                 'min_cats': min_cats,
                 'max_cats': max_cats,
                 'min_rating': min_rating,
                 'max_rating': max_rating,
-                'verified_only': verified_only
+                'verified_only': verified_only,
+                'sort': sort
             }
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
+DEFAULT_NEARBY_LIMIT = 100
+MAX_NEARBY_LIMIT = 500
+DEFAULT_NEAREST_K = 10
+MAX_NEAREST_K = 100
+DEFAULT_MAX_RADIUS = 50.0  # km
+DEFAULT_SUGGEST_LIMIT = 10
+MAX_SUGGEST_LIMIT = 25
+
+def active_cats_at(bodega_distances):
+    """(distance, cat_id) keys for the active cats of the given bodegas"""
+    if not bodega_distances:
+        return []
+    rows = db.session.query(Cat.id, Cat.bodega_id).filter(
+        Cat.is_active == True,
+        Cat.bodega_id.in_(list(bodega_distances))
+    ).all()
+    return [(bodega_distances[bodega_id], cat_id) for cat_id, bodega_id in rows]
+
+def load_cats(keys):
+    """Cat rows for (distance, cat_id) keys, in key order"""
+    if not keys:
+        return []
+    cats = {cat.id: cat for cat in Cat.query.options(*CAT_LIST_OPTIONS).filter(Cat.id.in_([cat_id for _, cat_id in keys]))}
+    return [(cats[cat_id], distance) for distance, cat_id in keys if cat_id in cats]
+
+def load_bodegas(keys):
+    """Bodega rows for (distance, bodega_id) keys, in key order"""
+    if not keys:
+        return []
+    bodegas = {bodega.id: bodega for bodega in Bodega.query.options(*BODEGA_LIST_OPTIONS).filter(Bodega.id.in_([bodega_id for _, bodega_id in keys]))}
+    return [(bodegas[bodega_id], distance) for distance, bodega_id in keys if bodega_id in bodegas]
+
 @search_bp.route('/nearby', methods=['GET'])
 def search_nearby():
     try:
@@ -174,88 +187,110 @@ def search_nearby():
         lng = request.args.get('lng', type=float)
         radius = request.args.get('radius', 5.0, type=float)  # Default 5km radius
         search_type = request.args.get('type', 'both')  # 'cats', 'bodegas', or 'both'
+        limit = min(request.args.get('limit', DEFAULT_NEARBY_LIMIT, type=int), MAX_NEARBY_LIMIT)
+        cats_cursor = request.args.get('cats_after')
+        bodegas_cursor = request.args.get('bodegas_after')
         
         if not lat or not lng:
             return jsonify({'error': 'Latitude and longitude are required'}), 400
         
-        # Haversine distance calculation
-        def haversine_distance(lat1, lon1, lat2, lon2):
-            R = 6371  # Earth's radius in kilometers
-            
-            lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-            dlat = lat2 - lat1
-            dlon = lon2 - lon1
-            
-            a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-            c = 2 * math.asin(math.sqrt(a))
-            distance = R * c
-            
-            return distance
+        if limit < 1:
+            return jsonify({'error': 'Limit must be positive'}), 400
+        
+        check_radius(radius)
+        
+        # Bodegas within the radius, nearest first
+        nearby = bodega_index.nearby(lat, lng, radius)
         
         results = {
             'search_location': {'lat': lat, 'lng': lng},
             'radius': radius,
             'cats': [],
-            'bodegas': []
+            'bodegas': [],
+            'pagination': {
+                'limit': limit,
+                'cats_next_cursor': None,
+                'bodegas_next_cursor': None
+            }
         }
         
         # Search for cats
         if search_type in ['cats', 'both']:
-            cats = Cat.query.filter(Cat.is_active == True).all()
-            for cat in cats:
-                distance = haversine_distance(lat, lng, cat.bodega.latitude, cat.bodega.longitude)
-                if distance <= radius:
-                    results['cats'].append({
-                        'id': cat.id,
-                        'name': cat.name,
-                        'bodega_id': cat.bodega_id,
-                        'bodega_name': cat.bodega.name,
-                        'address': cat.bodega.address,
-                        'latitude': cat.bodega.latitude,
-                        'longitude': cat.bodega.longitude,
-                        'description': cat.description,
-                        'age': cat.age,
-                        'breed': cat.breed,
-                        'sex': cat.sex,
-                        'personality': cat.personality,
-                        'color': cat.color,
-                        'weight': cat.weight,
-                        'is_friendly': cat.is_friendly,
-                        'rating': cat.rating,
-                        'review_count': cat.review_count,
-                        'distance': round(distance, 2),
-                        'primary_photo': next((photo.filename for photo in cat.photos if photo.is_primary), None)
-                    })
+            keys = sorted(active_cats_at(dict(nearby)))
+            page, results['pagination']['cats_next_cursor'] = paginate_keys(keys, cats_cursor, limit)
+            results['cats'] = [serialize_cat(cat, distance=round(distance, 2)) for cat, distance in load_cats(page)]
         
         # Search for bodegas
         if search_type in ['bodegas', 'both']:
-            bodegas = Bodega.query.all()
-            for bodega in bodegas:
-                distance = haversine_distance(lat, lng, bodega.latitude, bodega.longitude)
-                if distance <= radius:
-                    results['bodegas'].append({
-                        'id': bodega.id,
-                        'name': bodega.name,
-                        'address': bodega.address,
-                        'latitude': bodega.latitude,
-                        'longitude': bodega.longitude,
-                        'description': bodega.description,
-                        'phone': bodega.phone,
-                        'hours': bodega.hours,
-                        'rating': bodega.rating,
-                        'review_count': bodega.review_count,
-                        'cat_count': bodega.cat_count,
-                        'is_verified': bodega.is_verified,
-                        'distance': round(distance, 2),
-                        'primary_photo': next((photo.filename for photo in bodega.photos if photo.is_primary), None)
-                    })
-        
-        # Sort by distance
-        results['cats'].sort(key=lambda x: x['distance'])
-        results['bodegas'].sort(key=lambda x: x['distance'])
+            keys = [(distance, bodega_id) for bodega_id, distance in nearby]
+            page, results['pagination']['bodegas_next_cursor'] = paginate_keys(keys, bodegas_cursor, limit)
+            results['bodegas'] = [serialize_bodega(bodega, distance=round(distance, 2)) for bodega, distance in load_bodegas(page)]
+        
+        return jsonify(results), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Internal server error'}), 500
+
+@search_bp.route('/nearest', methods=['GET'])
+def search_nearest():
+    try:
+        lat = request.args.get('lat', type=float)
+        lng = request.args.get('lng', type=float)
+        k = min(request.args.get('k', DEFAULT_NEAREST_K, type=int), MAX_NEAREST_K)
+        max_radius = min(request.args.get('max_radius', DEFAULT_MAX_RADIUS, type=float), MAX_SEARCH_RADIUS)
+        search_type = request.args.get('type', 'both')  # 'cats', 'bodegas', or 'both'
+        
+        if not lat or not lng:
+            return jsonify({'error': 'Latitude and longitude are required'}), 400
+        
+        if k < 1:
+            return jsonify({'error': 'k must be positive'}), 400
+        
+        check_radius(max_radius)
+        
+        results = {
+            'search_location': {'lat': lat, 'lng': lng},
+            'k': k,
+            'cats': [],
+            'bodegas': []
+        }
+        
+        # Widen the search until it covers k active cats, then keep the k closest
+        if search_type in ['cats', 'both']:
+            keys = []
+            for nearby in bodega_index.expanding(lat, lng, max_radius):
+                keys = active_cats_at(dict(nearby))
+                if len(keys) >= k:
+                    break
+            closest = heapq.nsmallest(k, keys)
+            results['cats'] = [serialize_cat(cat, distance=round(distance, 2)) for cat, distance in load_cats(closest)]
+        
+        if search_type in ['bodegas', 'both']:
+            closest = [(distance, bodega_id) for bodega_id, distance in bodega_index.nearest(lat, lng, k, max_radius)]
+            results['bodegas'] = [serialize_bodega(bodega, distance=round(distance, 2)) for bodega, distance in load_bodegas(closest)]
         
         return jsonify(results), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Internal server error'}), 500
+
+@search_bp.route('/suggest', methods=['GET'])
+def suggest():
+    try:
+        q = request.args.get('q', '')
+        limit = min(request.args.get('limit', DEFAULT_SUGGEST_LIMIT, type=int), MAX_SUGGEST_LIMIT)
+        
+        suggestions = suggestion_index.suggest(q, max(limit, 0))
+        
+        return jsonify({
+            'query': q,
+            'suggestions': [{'type': kind, 'text': text} for kind, text in suggestions]
+        }), 200
+        
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
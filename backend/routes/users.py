@@ -1,7 +1,17 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 from models import db, User, SavedCat, SavedBodega, RecentlyViewed, Cat, Bodega
-from sqlalchemy import desc
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+from utils.integrity import is_unique_violation
+from utils.pagination import paginate_list
+from utils.saved import bulk_save, bulk_unsave, request_ids, saved_state
+from utils.serializers import (
+    SAVED_CAT_OPTIONS, SAVED_BODEGA_OPTIONS, RECENTLY_VIEWED_OPTIONS, RECENTLY_VIEWED_CAT_OPTIONS,
+    serialize_cat, serialize_bodega
+)
+from utils.stats import user_stats
+from utils.views import view_buffer
 
 users_bp = Blueprint('users', __name__)
 
@@ -14,41 +24,27 @@ def test_users():
 def get_saved_cats():
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         
-        saved_cats = SavedCat.query.filter_by(user_id=user_id).paginate(
-            page=page, per_page=per_page, error_out=False
+        # Most recently saved first, inactive cats filtered out before paging
+        saved_cats, pagination = paginate_list(
+            SavedCat.query.join(SavedCat.cat).options(*SAVED_CAT_OPTIONS).filter(
+                SavedCat.user_id == user_id,
+                Cat.is_active == True
+            ),
+            [(SavedCat.id, True)],
+            request.args
         )
         
         return jsonify({
-            'saved_cats': [{
-                'id': saved_cat.cat.id,
-                'name': saved_cat.cat.name,
-                'bodega_id': saved_cat.cat.bodega_id,
-                'bodega_name': saved_cat.cat.bodega.name,
-                'address': saved_cat.cat.bodega.address,
-                'description': saved_cat.cat.description,
-                'age': saved_cat.cat.age,
-                'breed': saved_cat.cat.breed,
-                'sex': saved_cat.cat.sex,
-                'personality': saved_cat.cat.personality,
-                'color': saved_cat.cat.color,
-                'weight': saved_cat.cat.weight,
-                'is_friendly': saved_cat.cat.is_friendly,
-                'rating': saved_cat.cat.rating,
-                'review_count': saved_cat.cat.review_count,
-                'primary_photo': next((photo.filename for photo in saved_cat.cat.photos if photo.is_primary), None) if saved_cat.cat.photos else None,
-                'saved_at': saved_cat.created_at.isoformat()
-            } for saved_cat in saved_cats.items if saved_cat.cat.is_active],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': saved_cats.total,
-                'pages': saved_cats.pages
-            }
+            'saved_cats': [
+                serialize_cat(saved_cat.cat, saved_at=saved_cat.created_at.isoformat())
+                for saved_cat in saved_cats
+            ],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
@@ -57,105 +53,119 @@ def get_saved_cats():
 def get_saved_bodegas():
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         
-        saved_bodegas = SavedBodega.query.filter_by(user_id=user_id).paginate(
-            page=page, per_page=per_page, error_out=False
+        # Most recently saved first
+        saved_bodegas, pagination = paginate_list(
+            SavedBodega.query.join(SavedBodega.bodega).options(*SAVED_BODEGA_OPTIONS).filter(
+                SavedBodega.user_id == user_id
+            ),
+            [(SavedBodega.id, True)],
+            request.args
         )
         
         return jsonify({
-            'saved_bodegas': [{
-                'id': saved_bodega.bodega.id,
-                'name': saved_bodega.bodega.name,
-                'address': saved_bodega.bodega.address,
-                'latitude': saved_bodega.bodega.latitude,
-                'longitude': saved_bodega.bodega.longitude,
-                'description': saved_bodega.bodega.description,
-                'phone': saved_bodega.bodega.phone,
-                'hours': saved_bodega.bodega.hours,
-                'rating': saved_bodega.bodega.rating,
-                'review_count': saved_bodega.bodega.review_count,
-                'cat_count': saved_bodega.bodega.cat_count,
-                'is_verified': saved_bodega.bodega.is_verified,
-                'primary_photo': next((photo.filename for photo in saved_bodega.bodega.photos if photo.is_primary), None) if saved_bodega.bodega.photos else None,
-                'saved_at': saved_bodega.created_at.isoformat()
-            } for saved_bodega in saved_bodegas.items],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': saved_bodegas.total,
-                'pages': saved_bodegas.pages
-            }
+            'saved_bodegas': [
+                serialize_bodega(saved_bodega.bodega, saved_at=saved_bodega.created_at.isoformat())
+                for saved_bodega in saved_bodegas
+            ],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
+@users_bp.route('/saved-state', methods=['GET'])
+@jwt_required()
+def get_saved_state():
+    try:
+        user_id = int(get_jwt_identity())
+        
+        # e.g. ?cat_ids=1,2,3&bodega_ids=4
+        return jsonify(saved_state(user_id, request_ids(request.args))), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': 'Internal server error'}), 500
+
+@users_bp.route('/bulk-save', methods=['POST'])
+@jwt_required()
+def bulk_save_items():
+    try:
+        user_id = int(get_jwt_identity())
+        ids = request_ids(request.get_json(silent=True), required=True)
+        
+        # A concurrent save of the same item trips the unique indexes; the retry skips it
+        for attempt in range(2):
+            try:
+                result = bulk_save(user_id, ids)
+                db.session.commit()
+                break
+            except IntegrityError as e:
+                db.session.rollback()
+                if attempt or not is_unique_violation(e):
+                    raise
+        
+        return jsonify({'message': 'Items saved successfully', **result}), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Internal server error'}), 500
+
+@users_bp.route('/bulk-unsave', methods=['POST'])
+@jwt_required()
+def bulk_unsave_items():
+    try:
+        user_id = int(get_jwt_identity())
+        ids = request_ids(request.get_json(silent=True), required=True)
+        
+        result = bulk_unsave(user_id, ids)
+        db.session.commit()
+        
+        return jsonify({'message': 'Items removed from saved', **result}), 200
+        
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': 'Internal server error'}), 500
+
 @users_bp.route('/recently-viewed', methods=['GET'])
 @jwt_required()
 def get_recently_viewed():
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
         
-        recently_viewed = RecentlyViewed.query.filter_by(user_id=user_id).order_by(
-            desc(RecentlyViewed.viewed_at)
-        ).paginate(page=page, per_page=per_page, error_out=False)
+        # Only active cats and bodegas that still exist
+        recently_viewed, pagination = paginate_list(
+            RecentlyViewed.query.outerjoin(RecentlyViewed.cat).outerjoin(RecentlyViewed.bodega).options(
+                *RECENTLY_VIEWED_OPTIONS
+            ).filter(
+                RecentlyViewed.user_id == user_id,
+                or_(Cat.is_active == True, Bodega.id.isnot(None))
+            ),
+            [(RecentlyViewed.viewed_at, True), (RecentlyViewed.id, True)],
+            request.args
+        )
         
         items = []
-        for item in recently_viewed.items:
-            if item.cat_id and item.cat and item.cat.is_active:
-                items.append({
-                    'type': 'cat',
-                    'id': item.cat.id,
-                    'name': item.cat.name,
-                    'bodega_id': item.cat.bodega_id,
-                    'bodega_name': item.cat.bodega.name,
-                    'address': item.cat.bodega.address,
-                    'description': item.cat.description,
-                    'age': item.cat.age,
-                    'breed': item.cat.breed,
-                    'sex': item.cat.sex,
-                    'personality': item.cat.personality,
-                    'color': item.cat.color,
-                    'weight': item.cat.weight,
-                    'is_friendly': item.cat.is_friendly,
-                    'rating': item.cat.rating,
-                    'review_count': item.cat.review_count,
-                    'primary_photo': next((photo.filename for photo in item.cat.photos if photo.is_primary), None) if item.cat.photos else None,
-                    'viewed_at': item.viewed_at.isoformat()
-                })
-            elif item.bodega_id and item.bodega:
-                items.append({
-                    'type': 'bodega',
-                    'id': item.bodega.id,
-                    'name': item.bodega.name,
-                    'address': item.bodega.address,
-                    'latitude': item.bodega.latitude,
-                    'longitude': item.bodega.longitude,
-                    'description': item.bodega.description,
-                    'phone': item.bodega.phone,
-                    'hours': item.bodega.hours,
-                    'rating': item.bodega.rating,
-                    'review_count': item.bodega.review_count,
-                    'cat_count': item.bodega.cat_count,
-                    'is_verified': item.bodega.is_verified,
-                    'primary_photo': next((photo.filename for photo in item.bodega.photos if photo.is_primary), None) if item.bodega.photos else None,
-                    'viewed_at': item.viewed_at.isoformat()
-                })
+        for item in recently_viewed:
+            if item.cat_id:
+                items.append(serialize_cat(item.cat, type='cat', viewed_at=item.viewed_at.isoformat()))
+            else:
+                items.append(serialize_bodega(item.bodega, type='bodega', viewed_at=item.viewed_at.isoformat()))
         
         return jsonify({
             'recently_viewed': items,
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': recently_viewed.total,
-                'pages': recently_viewed.pages
-            }
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
@@ -164,44 +174,27 @@ def get_recently_viewed():
 def get_recently_viewed_cats():
     try:
         user_id = int(get_jwt_identity())
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
-        
-        recently_viewed_cats = RecentlyViewed.query.filter_by(
-            user_id=user_id,
-            cat_id=RecentlyViewed.cat_id.isnot(None)
-        ).order_by(desc(RecentlyViewed.viewed_at)).paginate(
-            page=page, per_page=per_page, error_out=False
+        
+        # The inner join keeps only cat views, of cats that are still active
+        recently_viewed_cats, pagination = paginate_list(
+            RecentlyViewed.query.join(RecentlyViewed.cat).options(*RECENTLY_VIEWED_CAT_OPTIONS).filter(
+                RecentlyViewed.user_id == user_id,
+                Cat.is_active == True
+            ),
+            [(RecentlyViewed.viewed_at, True), (RecentlyViewed.id, True)],
+            request.args
         )
         
         return jsonify({
-            'recently_viewed_cats': [{
-                'id': item.cat.id,
-                'name': item.cat.name,
-                'bodega_id': item.cat.bodega_id,
-                'bodega_name': item.cat.bodega.name,
-                'address': item.cat.bodega.address,
-                'description': item.cat.description,
-                'age': item.cat.age,
-                'breed': item.cat.breed,
-                'sex': item.cat.sex,
-                'personality': item.cat.personality,
-                'color': item.cat.color,
-                'weight': item.cat.weight,
-                'is_friendly': item.cat.is_friendly,
-                'rating': item.cat.rating,
-                'review_count': item.cat.review_count,
-                'primary_photo': next((photo.filename for photo in item.cat.photos if photo.is_primary), None) if item.cat.photos else None,
-                'viewed_at': item.viewed_at.isoformat()
-            } for item in recently_viewed_cats.items if item.cat and item.cat.is_active],
-            'pagination': {
-                'page': page,
-                'per_page': per_page,
-                'total': recently_viewed_cats.total,
-                'pages': recently_viewed_cats.pages
-            }
+            'recently_viewed_cats': [
+                serialize_cat(item.cat, viewed_at=item.viewed_at.isoformat())
+                for item in recently_viewed_cats
+            ],
+            'pagination': pagination
         }), 200
         
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'Internal server error'}), 500
 
@@ -211,26 +204,9 @@ def get_user_stats():
     try:
         user_id = int(get_jwt_identity())
         
-        # Count saved cats
-        saved_cats_count = SavedCat.query.filter_by(user_id=user_id).count()
-        
-        # Count saved bodegas
-        saved_bodegas_count = SavedBodega.query.filter_by(user_id=user_id).count()
-        
-        # Count reviews
-        from ..models import Review
-        reviews_count = Review.query.filter_by(user_id=user_id).count()
-        
-        # Count recently viewed items
-        recently_viewed_count = RecentlyViewed.query.filter_by(user_id=user_id).count()
-        
+        # Saved cats, saved bodegas, reviews and recently viewed counts, cached per user
         return jsonify({
-            'stats': {
-                'saved_cats': saved_cats_count,
-                'saved_bodegas': saved_bodegas_count,
-                'reviews': reviews_count,
-                'recently_viewed': recently_viewed_count
-            }
+            'stats': user_stats.get(user_id)
         }), 200
         
     except Exception as e:
@@ -242,8 +218,11 @@ def clear_recently_viewed():
     try:
         user_id = int(get_jwt_identity())
         
+        # Views still waiting in the write buffer would otherwise reappear after the flush
+        view_buffer.discard(user_id)
         RecentlyViewed.query.filter_by(user_id=user_id).delete()
         db.session.commit()
+        user_stats.invalidate([user_id])
         
         return jsonify({'message': 'Recently viewed items cleared successfully'}), 200
         
@@ -0,0 +1,61 @@
+"""In-process LRU cache with expiring entries."""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+# Every worker process keeps its own copy of these caches and only sees its own
+# writes, so a TTL bounds how long writes made by other workers can go unseen.
+# Past max_entries the least recently used entries are dropped, bounding memory.
+
+
+class LRUCache:
+    """
+    Thread-safe LRU mapping whose entries expire ttl seconds after they are set
+    """
+
+    def __init__(self, max_entries: int, ttl: Optional[float] = None,
+                 on_evict: Optional[Callable[[Hashable, Any], None]] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()  # key -> (expires at, value)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable, default: Any = None, stale: bool = False) -> Any:
+        """
+        Value stored for key, or default if there is none or it has expired
+
+        Args:
+            stale (bool): Also return an expired value
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or (not stale and entry[0] is not None and entry[0] < time.monotonic()):
+                return default
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Store a value, expiring after ttl seconds or the cache's own ttl"""
+        ttl = self.ttl if ttl is None else ttl
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl if ttl is not None else None, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted, (_, evicted_value) = self._entries.popitem(last=False)
+                if self.on_evict is not None:
+                    self.on_evict(evicted, evicted_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,239 @@
+"""Server-side clustering of bodega markers for the map."""
+
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, inspect
+
+from models import db, Cat, Bodega
+from utils.cache import LRUCache
+from utils.commit_hooks import on_commit
+
+MAX_ZOOM = 20
+# Each tile is split into 2**CLUSTER_SHIFT cells per side, ~32px on a 256px tile
+CLUSTER_SHIFT = 3
+# Web Mercator cannot represent the poles
+MAX_LATITUDE = 85.05112878
+# Seconds before a cached tile is recomputed from the database
+DEFAULT_TTL = float(os.getenv('MAP_CLUSTER_TTL', 300))
+# Tiles cached
+DEFAULT_MAX_TILES = int(os.getenv('MAP_CLUSTER_MAX_TILES', 4096))
+
+Tile = Tuple[int, int, int]  # (zoom, x, y)
+
+
+def tile_for(lat: float, lng: float, zoom: int) -> Tile:
+    """Web Mercator tile containing (lat, lng) at the given zoom"""
+    n = 2 ** zoom
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    x = math.floor((lng + 180) / 360 * n)
+    y = math.floor((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return (zoom, min(max(x, 0), n - 1), min(max(y, 0), n - 1))
+
+
+def tile_bounds(tile: Tile) -> Tuple[float, float, float, float]:
+    """
+    Returns:
+        Tuple[float, float, float, float]: (min_lat, min_lng, max_lat, max_lng) of the tile
+    """
+    zoom, x, y = tile
+    n = 2 ** zoom
+
+    def latitude(row):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return (latitude(y + 1), x / n * 360 - 180, latitude(y), (x + 1) / n * 360 - 180)
+
+
+def _tile_range(min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                zoom: int) -> Tuple[int, int, int, int]:
+    _, min_x, min_y = tile_for(max_lat, min_lng, zoom)
+    _, max_x, max_y = tile_for(min_lat, max_lng, zoom)
+    return (min_x, min_y, max_x, max_y)
+
+
+def tile_count(min_lat: float, min_lng: float, max_lat: float, max_lng: float, zoom: int) -> int:
+    """Number of tiles tiles_covering would return, without listing them"""
+    min_x, min_y, max_x, max_y = _tile_range(min_lat, min_lng, max_lat, max_lng, zoom)
+    return (max_x - min_x + 1) * (max_y - min_y + 1)
+
+
+def tiles_covering(min_lat: float, min_lng: float, max_lat: float, max_lng: float, zoom: int) -> List[Tile]:
+    min_x, min_y, max_x, max_y = _tile_range(min_lat, min_lng, max_lat, max_lng, zoom)
+    return [(zoom, x, y) for x in range(min_x, max_x + 1) for y in range(min_y, max_y + 1)]
+
+
+def compute_clusters(rows: List[Tuple], zoom: int) -> Dict[Tile, Tuple[List[dict], Set[int]]]:
+    """
+    Group bodega rows into cluster cells and the tiles holding them
+
+    Args:
+        rows: (bodega_id, latitude, longitude, cat_id, cat_name, cat_rating) rows,
+            one per active cat, with the cat fields None for bodegas without one
+        zoom (int): Zoom level the clusters are drawn at
+
+    Returns:
+        Dict[Tile, Tuple[List[dict], Set[int]]]: Clusters and bodega ids per tile
+    """
+    bodegas = {}
+    for bodega_id, latitude, longitude, cat_id, cat_name, cat_rating in rows:
+        bodega = bodegas.setdefault(bodega_id, {'latitude': latitude, 'longitude': longitude, 'cats': []})
+        if cat_id is not None:
+            bodega['cats'].append((cat_rating or 0, -cat_id, cat_name))
+
+    cells = {}
+    for bodega_id, bodega in bodegas.items():
+        cell = tile_for(bodega['latitude'], bodega['longitude'], zoom + CLUSTER_SHIFT)
+        cells.setdefault(cell, []).append((bodega_id, bodega))
+
+    tiles = {}
+    for (_, cell_x, cell_y), members in cells.items():
+        tile = (zoom, cell_x >> CLUSTER_SHIFT, cell_y >> CLUSTER_SHIFT)
+        cats = [cat for _, bodega in members for cat in bodega['cats']]
+        top_cat = max(cats) if cats else None
+
+        cluster = {
+            'count': len(members),
+            'cat_count': len(cats),
+            'latitude': round(sum(bodega['latitude'] for _, bodega in members) / len(members), 6),
+            'longitude': round(sum(bodega['longitude'] for _, bodega in members) / len(members), 6),
+            'top_cat': {
+                'id': -top_cat[1],
+                'name': top_cat[2],
+                'rating': top_cat[0]
+            } if top_cat else None
+        }
+        if len(members) == 1:
+            cluster['bodega_id'] = members[0][0]
+
+        clusters, ids = tiles.setdefault(tile, ([], set()))
+        clusters.append(cluster)
+        ids.update(bodega_id for bodega_id, _ in members)
+
+    return tiles
+
+
+class ClusterCache:
+    """
+    Process-wide cache of per-tile marker clusters backed by the database
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_tiles: int = DEFAULT_MAX_TILES):
+        self._tiles = LRUCache(max_tiles, ttl, on_evict=self._unlink)  # tile -> (clusters, bodega ids)
+        self._tiles_by_bodega: Dict[int, Set[Tile]] = {}
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._tiles.clear()
+            self._tiles_by_bodega.clear()
+
+    def _unlink(self, tile: Tile, entry: Tuple[List[dict], Set[int]]) -> None:
+        for bodega_id in entry[1]:
+            tiles = self._tiles_by_bodega.get(bodega_id)
+            if tiles is not None:
+                tiles.discard(tile)
+                if not tiles:
+                    del self._tiles_by_bodega[bodega_id]
+
+    def _drop(self, tile: Tile) -> None:
+        entry = self._tiles.pop(tile)
+        if entry is not None:
+            self._unlink(tile, entry)
+
+    def _store(self, tile: Tile, clusters: List[dict], bodega_ids: Set[int]) -> None:
+        self._drop(tile)
+        for bodega_id in bodega_ids:
+            self._tiles_by_bodega.setdefault(bodega_id, set()).add(tile)
+        self._tiles.set(tile, (clusters, bodega_ids))
+
+    def _load_tiles(self, tiles: List[Tile]) -> None:
+        """
+        Compute the given tiles with a single bounding-box query over the
+        indexed latitude/longitude columns
+        """
+        zoom = tiles[0][0]
+        bounds = [tile_bounds(tile) for tile in tiles]
+        min_lat = min(bound[0] for bound in bounds)
+        min_lng = min(bound[1] for bound in bounds)
+        max_lat = max(bound[2] for bound in bounds)
+        max_lng = max(bound[3] for bound in bounds)
+
+        rows = db.session.query(
+            Bodega.id, Bodega.latitude, Bodega.longitude, Cat.id, Cat.name, Cat.rating
+        ).outerjoin(
+            Cat, and_(Cat.bodega_id == Bodega.id, Cat.is_active == True)
+        ).filter(
+            Bodega.latitude.between(min_lat, max_lat),
+            Bodega.longitude.between(min_lng, max_lng)
+        ).all()
+
+        computed = compute_clusters(rows, zoom)
+        with self._lock:
+            for tile in tiles:
+                clusters, bodega_ids = computed.get(tile, ([], set()))
+                self._store(tile, clusters, bodega_ids)
+
+    def clusters(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float,
+                 zoom: int) -> List[dict]:
+        """
+        Clusters whose centroid lies inside the bounding box at the given zoom
+        """
+        tiles = tiles_covering(min_lat, min_lng, max_lat, max_lng, zoom)
+
+        with self._lock:
+            stale = [tile for tile in tiles if self._tiles.get(tile) is None]
+        if stale:
+            self._load_tiles(stale)
+
+        results = []
+        with self._lock:
+            for tile in tiles:
+                entry = self._tiles.get(tile, stale=True)
+                if entry is None:
+                    continue  # Evicted by a concurrent request; it is recomputed next time
+                results.extend(cluster for cluster in entry[0]
+                               if min_lat <= cluster['latitude'] <= max_lat
+                               and min_lng <= cluster['longitude'] <= max_lng)
+        return results
+
+    def apply(self, changes: List[Tuple[List[int], Optional[Tuple[float, float]]]]) -> None:
+        """
+        Drop the tiles holding each changed bodega, and for bodegas with a new
+        position the tiles it now falls in
+        """
+        with self._lock:
+            for bodega_ids, position in changes:
+                for bodega_id in bodega_ids:
+                    for tile in list(self._tiles_by_bodega.get(bodega_id, ())):
+                        self._drop(tile)
+                if position is not None:
+                    for zoom in range(MAX_ZOOM + 1):
+                        self._drop(tile_for(position[0], position[1], zoom))
+
+
+cluster_cache = ClusterCache()
+
+
+def _cat_bodega_ids(cat) -> List[int]:
+    # A cat moved between bodegas changes the clusters of both
+    history = inspect(cat).attrs.bodega_id.history
+    return [bodega_id for bodega_id in {cat.bodega_id, *history.deleted} if bodega_id is not None]
+
+
+# Keep cached tiles in sync with bodega and cat writes once they commit
+on_commit(
+    Bodega,
+    lambda bodega, action: (
+        [bodega.id],
+        (bodega.latitude, bodega.longitude) if action != 'delete' and bodega.latitude is not None else None
+    ),
+    cluster_cache.apply
+)
+on_commit(
+    Cat,
+    lambda cat, action: (_cat_bodega_ids(cat), None),
+    cluster_cache.apply
+)
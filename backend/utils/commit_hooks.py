@@ -0,0 +1,52 @@
+"""Run callbacks for model changes once the surrounding transaction commits."""
+
+from typing import Any, Callable, List
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session, object_session
+
+_PENDING_KEY = 'commit_hooks'
+
+
+def on_commit(model, capture: Callable[[Any, str], Any], apply: Callable[[List[Any]], None]) -> None:
+    """
+    Register callbacks for inserts, updates and deletes of a model
+
+    Args:
+        model: Mapped class to watch
+        capture: Called at flush time as capture(target, action), where action is
+            'insert', 'update' or 'delete'; returns the change to queue
+        apply: Called after commit with the changes captured in that transaction
+    """
+    def listener_for(action):
+        def listener(mapper, connection, target):
+            session = object_session(target)
+            if session is not None:
+                session.info.setdefault(_PENDING_KEY, []).append((apply, capture(target, action)))
+        return listener
+
+    for action in ('insert', 'update', 'delete'):
+        event.listen(model, f'after_{action}', listener_for(action))
+
+
+@event.listens_for(Session, 'after_commit')
+def _run_pending(session):
+    pending = session.info.pop(_PENDING_KEY, None)
+    if not pending:
+        return
+
+    batches = {}
+    for apply, change in pending:
+        batches.setdefault(apply, []).append(change)
+
+    for apply, changes in batches.items():
+        try:
+            apply(changes)
+        except Exception as e:
+            # The transaction is already committed; never fail the request here
+            print(f"Warning: commit hook {apply.__qualname__} failed: {e}")
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    session.info.pop(_PENDING_KEY, None)
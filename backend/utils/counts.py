@@ -0,0 +1,182 @@
+"""Row totals for paginated responses without a COUNT(*) per request."""
+
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import inspect
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+from models import db, Cat, Bodega
+from utils.cache import LRUCache
+from utils.commit_hooks import on_commit
+
+TOTAL_MODES = ('exact', 'estimate', 'none')
+
+# Seconds a filtered count is served from the cache
+DEFAULT_TTL = float(os.getenv('COUNT_CACHE_TTL', 60))
+# Seconds before a counter is reloaded from the database
+DEFAULT_COUNTER_TTL = float(os.getenv('COUNTER_TTL', 600))
+# Filtered counts cached
+DEFAULT_MAX_ENTRIES = int(os.getenv('COUNT_CACHE_MAX_ENTRIES', 1024))
+
+
+class Counter:
+    """
+    Exact row count kept in memory and adjusted by committed writes
+    """
+
+    def __init__(self, load: Callable[[], int], ttl: float = DEFAULT_COUNTER_TTL):
+        self.load = load
+        self.ttl = ttl
+        self._value: Optional[int] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._value = None
+
+    def value(self) -> int:
+        with self._lock:
+            if self._value is not None and time.monotonic() - self._loaded_at <= self.ttl:
+                return self._value
+
+        value = self.load()
+        with self._lock:
+            self._value = value
+            self._loaded_at = time.monotonic()
+        return value
+
+    def apply(self, deltas: List[int]) -> None:
+        with self._lock:
+            if self._value is not None:
+                self._value += sum(deltas)
+
+
+class CountCache:
+    """
+    TTL cache of filtered counts keyed by the compiled count statement
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._entries = LRUCache(max_entries, ttl)
+
+    def invalidate(self) -> None:
+        self._entries.clear()
+
+    @staticmethod
+    def key(query) -> str:
+        # The same filters produce the same SQL and parameters whatever order they were added in the URL
+        compiled = query.order_by(None).statement.compile(dialect=db.engine.dialect)
+        return json.dumps([str(compiled), sorted(compiled.params.items())], default=repr)
+
+    def count(self, query) -> int:
+        key = self.key(query)
+        total = self._entries.get(key)
+        if total is None:
+            total = query.order_by(None).count()
+            self._entries.set(key, total)
+        return total
+
+    def estimate(self, query) -> Tuple[int, bool]:
+        """
+        Approximate count of the query
+
+        Returns:
+            Tuple[int, bool]: The count and whether it is an estimate rather
+            than a fresh exact count
+        """
+        key = self.key(query)
+        total = self._entries.get(key, stale=True)
+        if total is not None:
+            return total, True
+
+        estimate = planner_estimate(query)
+        if estimate is not None:
+            return estimate, True
+
+        total = query.order_by(None).count()
+        self._entries.set(key, total)
+        return total, False
+
+
+class _ExplainJSON(Executable, ClauseElement):
+    """EXPLAIN (FORMAT JSON) of a select, executed with its parameters bound"""
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(_ExplainJSON)
+def _compile_explain_json(element, compiler, **kw):
+    return 'EXPLAIN (FORMAT JSON) ' + compiler.process(element.statement, **kw)
+
+
+def planner_estimate(query) -> Optional[int]:
+    """
+    Row estimate from the Postgres query planner, or None where unavailable
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return None
+
+    try:
+        plan = db.session.execute(_ExplainJSON(query.order_by(None).statement)).scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        print(f"Warning: planner estimate failed: {e}")
+        return None
+
+
+count_cache = CountCache()
+
+active_cats_counter = Counter(lambda: Cat.query.filter(Cat.is_active == True).count())
+bodegas_counter = Counter(lambda: Bodega.query.count())
+
+
+def total_for(query, mode: str, counter: Optional[Counter] = None) -> Tuple[Optional[int], bool]:
+    """
+    Total row count of a list query
+
+    Args:
+        query: The list query, before paging
+        mode (str): 'exact', 'estimate' or 'none'
+        counter (Optional[Counter]): Counter holding the total when the query is unfiltered
+
+    Returns:
+        Tuple[Optional[int], bool]: The total, None in 'none' mode, and whether it is estimated
+    """
+    if mode == 'none':
+        return None, False
+    if counter is not None:
+        return counter.value(), False
+    if mode == 'estimate':
+        return count_cache.estimate(query)
+    return count_cache.count(query), False
+
+
+def _active_cat_delta(cat, action: str) -> int:
+    if action == 'insert':
+        return 1 if cat.is_active else 0
+    if action == 'delete':
+        return -1 if cat.is_active else 0
+
+    history = inspect(cat).attrs.is_active.history
+    if not history.deleted:
+        return 0
+    return (1 if cat.is_active else 0) - (1 if history.deleted[0] else 0)
+
+
+# Keep the counters in step with writes once they commit
+on_commit(Cat, _active_cat_delta, active_cats_counter.apply)
+on_commit(
+    Bodega,
+    lambda bodega, action: {'insert': 1, 'delete': -1}.get(action, 0),
+    bodegas_counter.apply
+)
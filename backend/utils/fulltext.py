@@ -0,0 +1,261 @@
+"""Full-text search over cats and bodegas: FTS5 on SQLite, tsvector on Postgres, ILIKE elsewhere."""
+
+import re
+from typing import List, Optional
+
+from sqlalchemy import column, func, literal_column, or_, select, table
+
+from models import db, Cat, Bodega
+
+# Indexed text columns, in FTS5 column order
+CAT_FIELDS = ['name', 'description', 'breed', 'personality']
+CAT_BODEGA_FIELDS = ['bodega_name', 'bodega_address']
+BODEGA_FIELDS = ['name', 'address', 'description']
+
+# bm25 column weights: names count most, free text least
+CAT_WEIGHTS = '10.0, 1.0, 5.0, 3.0, 4.0, 2.0'
+BODEGA_WEIGHTS = '10.0, 4.0, 1.0'
+
+SQLITE_SETUP = [
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS cats_fts USING fts5(
+        {', '.join(CAT_FIELDS + CAT_BODEGA_FIELDS)},
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS bodegas_fts USING fts5(
+        {', '.join(BODEGA_FIELDS)},
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cats_fts_insert AFTER INSERT ON cats BEGIN
+        INSERT INTO cats_fts (rowid, name, description, breed, personality, bodega_name, bodega_address)
+        SELECT new.id, new.name, new.description, new.breed, new.personality, b.name, b.address
+        FROM bodegas b WHERE b.id = new.bodega_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cats_fts_update
+    AFTER UPDATE OF name, description, breed, personality, bodega_id ON cats BEGIN
+        DELETE FROM cats_fts WHERE rowid = old.id;
+        INSERT INTO cats_fts (rowid, name, description, breed, personality, bodega_name, bodega_address)
+        SELECT new.id, new.name, new.description, new.breed, new.personality, b.name, b.address
+        FROM bodegas b WHERE b.id = new.bodega_id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cats_fts_delete AFTER DELETE ON cats BEGIN
+        DELETE FROM cats_fts WHERE rowid = old.id;
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bodegas_fts_insert AFTER INSERT ON bodegas BEGIN
+        INSERT INTO bodegas_fts (rowid, name, address, description)
+        VALUES (new.id, new.name, new.address, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bodegas_fts_update
+    AFTER UPDATE OF name, address, description ON bodegas BEGIN
+        DELETE FROM bodegas_fts WHERE rowid = old.id;
+        INSERT INTO bodegas_fts (rowid, name, address, description)
+        VALUES (new.id, new.name, new.address, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bodegas_fts_cats_update
+    AFTER UPDATE OF name, address ON bodegas BEGIN
+        UPDATE cats_fts SET bodega_name = new.name, bodega_address = new.address
+        WHERE rowid IN (SELECT id FROM cats WHERE bodega_id = new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS bodegas_fts_delete AFTER DELETE ON bodegas BEGIN
+        DELETE FROM bodegas_fts WHERE rowid = old.id;
+    END
+    """,
+    f"INSERT INTO cats_fts (cats_fts, rank) VALUES ('rank', 'bm25({CAT_WEIGHTS})')",
+    f"INSERT INTO bodegas_fts (bodegas_fts, rank) VALUES ('rank', 'bm25({BODEGA_WEIGHTS})')",
+]
+
+SQLITE_REBUILD = [
+    "DELETE FROM cats_fts",
+    """
+    INSERT INTO cats_fts (rowid, name, description, breed, personality, bodega_name, bodega_address)
+    SELECT c.id, c.name, c.description, c.breed, c.personality, b.name, b.address
+    FROM cats c JOIN bodegas b ON b.id = c.bodega_id
+    """,
+    "DELETE FROM bodegas_fts",
+    """
+    INSERT INTO bodegas_fts (rowid, name, address, description)
+    SELECT id, name, address, description FROM bodegas
+    """,
+]
+
+POSTGRES_SETUP = [
+    """
+    ALTER TABLE cats ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(breed, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(personality, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_cats_search_vector ON cats USING GIN (search_vector)",
+    """
+    ALTER TABLE bodegas ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(address, '')), 'B') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'C')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_bodegas_search_vector ON bodegas USING GIN (search_vector)",
+]
+
+cats_fts = table('cats_fts', column('rowid'), column('rank'))
+bodegas_fts = table('bodegas_fts', column('rowid'), column('rank'))
+
+# Which engine serves searches: 'fts5', 'postgres', or None for ILIKE
+_engine: Optional[str] = None
+
+
+def setup_fulltext() -> Optional[str]:
+    """
+    Create the full-text index structures for the current database
+
+    Must run inside an app context after db.create_all(). Safe to call on
+    every startup; the SQLite index is only repopulated when it is missing
+    rows.
+
+    Returns:
+        Optional[str]: The search engine now in use, or None for ILIKE
+    """
+    global _engine
+
+    dialect = db.engine.dialect.name
+    try:
+        with db.engine.begin() as conn:
+            if dialect == 'sqlite':
+                for statement in SQLITE_SETUP:
+                    conn.execute(db.text(statement))
+                indexed = conn.execute(db.text("SELECT count(*) FROM bodegas_fts")).scalar()
+                indexed += conn.execute(db.text("SELECT count(*) FROM cats_fts")).scalar()
+                stored = conn.execute(db.text("SELECT count(*) FROM bodegas")).scalar()
+                stored += conn.execute(db.text("SELECT count(*) FROM cats")).scalar()
+                if indexed != stored:
+                    for statement in SQLITE_REBUILD:
+                        conn.execute(db.text(statement))
+                _engine = 'fts5'
+            elif dialect == 'postgresql':
+                for statement in POSTGRES_SETUP:
+                    conn.execute(db.text(statement))
+                _engine = 'postgres'
+            else:
+                _engine = None
+    except Exception as e:
+        print(f"Full-text search unavailable, falling back to ILIKE: {e}")
+        _engine = None
+
+    return _engine
+
+
+def _terms(search: str) -> List[str]:
+    return re.findall(r'\w+', search)
+
+
+def _fts5_query(terms: List[str], fields: Optional[List[str]] = None) -> str:
+    # Every term must appear, as a word or a word prefix
+    expression = ' '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+    if fields:
+        expression = '{%s} : (%s)' % (' '.join(fields), expression)
+    return expression
+
+
+def _tsquery(terms: List[str]):
+    """
+    Postgres query matching every term as a word or word prefix, or None when
+    nothing is left to match once stopwords are dropped
+    """
+    # Parsed one quoted term at a time so a stopword only drops itself, and
+    # ANDed with && which ignores the empty queries stopwords leave behind
+    tsquery = None
+    for term in terms:
+        term_query = func.to_tsquery('english', f"'{term}':*")
+        tsquery = term_query if tsquery is None else tsquery.op('&&')(term_query)
+
+    if not db.session.execute(select(func.numnode(tsquery))).scalar():
+        return None
+    return tsquery
+
+
+def match_cats(query, search: str, include_bodega: bool = False):
+    """
+    Restrict a Cat query to cats matching the search text
+
+    Args:
+        query: Cat query to filter
+        search (str): Text entered by the user
+        include_bodega (bool): Also match the name and address of the cat's bodega
+
+    Returns:
+        The filtered query and a rank expression that sorts the best matches
+        first in ascending order, or None when matches are unranked
+    """
+    terms = _terms(search)
+
+    if _engine == 'fts5' and terms:
+        fields = CAT_FIELDS + CAT_BODEGA_FIELDS if include_bodega else CAT_FIELDS
+        matches = select(cats_fts.c.rowid.label('id'), cats_fts.c.rank.label('rank')).where(
+            literal_column('cats_fts').op('MATCH')(_fts5_query(terms, fields))
+        ).subquery()
+        return query.join(matches, Cat.id == matches.c.id), matches.c.rank
+
+    tsquery = _tsquery(terms) if _engine == 'postgres' and terms else None
+    if tsquery is not None:
+        cat_vector = literal_column('cats.search_vector')
+        if include_bodega:
+            bodega_vector = literal_column('bodegas.search_vector')
+            return query.join(Bodega, Cat.bodega_id == Bodega.id).filter(
+                or_(cat_vector.op('@@')(tsquery), bodega_vector.op('@@')(tsquery))
+            ), -(func.ts_rank(cat_vector, tsquery) + func.ts_rank(bodega_vector, tsquery))
+        return query.filter(cat_vector.op('@@')(tsquery)), -func.ts_rank(cat_vector, tsquery)
+
+    predicates = [getattr(Cat, field).ilike(f'%{search}%') for field in CAT_FIELDS]
+    if include_bodega:
+        predicates += [
+            Cat.bodega.has(Bodega.name.ilike(f'%{search}%')),
+            Cat.bodega.has(Bodega.address.ilike(f'%{search}%'))
+        ]
+    return query.filter(or_(*predicates)), None
+
+
+def match_bodegas(query, search: str):
+    """
+    Restrict a Bodega query to bodegas matching the search text
+
+    Args:
+        query: Bodega query to filter
+        search (str): Text entered by the user
+
+    Returns:
+        The filtered query and a rank expression that sorts the best matches
+        first in ascending order, or None when matches are unranked
+    """
+    terms = _terms(search)
+
+    if _engine == 'fts5' and terms:
+        matches = select(bodegas_fts.c.rowid.label('id'), bodegas_fts.c.rank.label('rank')).where(
+            literal_column('bodegas_fts').op('MATCH')(_fts5_query(terms))
+        ).subquery()
+        return query.join(matches, Bodega.id == matches.c.id), matches.c.rank
+
+    tsquery = _tsquery(terms) if _engine == 'postgres' and terms else None
+    if tsquery is not None:
+        vector = literal_column('bodegas.search_vector')
+        return query.filter(vector.op('@@')(tsquery)), -func.ts_rank(vector, tsquery)
+
+    return query.filter(or_(*[getattr(Bodega, field).ilike(f'%{search}%') for field in BODEGA_FIELDS])), None
@@ -0,0 +1,212 @@
+"""Background geocoding of bodegas created without coordinates."""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Optional, Set
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import inspect, or_, select, update
+
+from models import db, Bodega
+from utils.commit_hooks import on_commit
+from utils.geocoding import GeocodingUnavailable, lookup_address
+
+PENDING = 'pending'
+OK = 'ok'
+FAILED = 'failed'
+
+# Threads resolving addresses
+DEFAULT_WORKERS = int(os.getenv('GEOCODE_WORKERS', 4))
+# Seconds between scans for due bodegas
+DEFAULT_POLL_INTERVAL = float(os.getenv('GEOCODE_POLL_INTERVAL', 15))
+# Lookups per bodega before it is marked failed
+MAX_ATTEMPTS = int(os.getenv('GEOCODE_MAX_ATTEMPTS', 8))
+# Seconds before the first retry, doubling with each failure up to RETRY_MAX_DELAY
+RETRY_BASE_DELAY = float(os.getenv('GEOCODE_RETRY_BASE_DELAY', 30))
+RETRY_MAX_DELAY = float(os.getenv('GEOCODE_RETRY_MAX_DELAY', 6 * 3600))
+# Seconds to wait while the geocoder is unavailable; these waits are not counted as attempts
+UNAVAILABLE_DELAY = float(os.getenv('GEOCODE_UNAVAILABLE_DELAY', 300))
+# Seconds a claimed bodega is reserved for the worker holding it
+CLAIM_TIMEOUT = 120
+# Due bodegas picked up per scan
+POLL_BATCH_SIZE = 100
+
+
+def retry_delay(attempts: int) -> float:
+    return min(RETRY_BASE_DELAY * 2 ** max(attempts - 1, 0), RETRY_MAX_DELAY)
+
+
+def _claim(bodega_id: int) -> bool:
+    """Reserve a due pending bodega; False if it is not due or another worker has it"""
+    now = datetime.utcnow()
+    result = db.session.execute(
+        update(Bodega).where(
+            Bodega.id == bodega_id,
+            Bodega.geocode_status == PENDING,
+            or_(Bodega.geocode_next_attempt_at.is_(None), Bodega.geocode_next_attempt_at <= now)
+        ).values(
+            geocode_next_attempt_at=now + timedelta(seconds=CLAIM_TIMEOUT),
+            updated_at=Bodega.updated_at
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def resolve(bodega_id: int) -> Optional[str]:
+    """
+    Geocode one pending bodega and record the outcome
+
+    Returns:
+        Optional[str]: The bodega's new geocode_status, or None if it was not claimed
+    """
+    if not _claim(bodega_id):
+        return None
+
+    bodega = db.session.get(Bodega, bodega_id)
+    if bodega is None:
+        return None
+
+    try:
+        coordinates = lookup_address(bodega.address)
+    except GeocodingUnavailable:
+        # Provider down or misconfigured: try again later without spending an attempt
+        bodega.geocode_next_attempt_at = datetime.utcnow() + timedelta(seconds=UNAVAILABLE_DELAY)
+        db.session.commit()
+        return bodega.geocode_status
+
+    if coordinates:
+        bodega.latitude, bodega.longitude = coordinates
+        bodega.geocode_status = OK
+        bodega.geocode_next_attempt_at = None
+    else:
+        bodega.geocode_attempts = (bodega.geocode_attempts or 0) + 1
+        if bodega.geocode_attempts >= MAX_ATTEMPTS:
+            bodega.geocode_status = FAILED
+            bodega.geocode_next_attempt_at = None
+            print(f"Warning: giving up geocoding bodega {bodega_id} after {bodega.geocode_attempts} attempts")
+        else:
+            bodega.geocode_next_attempt_at = datetime.utcnow() + timedelta(
+                seconds=retry_delay(bodega.geocode_attempts)
+            )
+
+    db.session.commit()
+    return bodega.geocode_status
+
+
+def due_bodega_ids(limit: int = POLL_BATCH_SIZE) -> List[int]:
+    return list(db.session.scalars(
+        select(Bodega.id).where(
+            Bodega.geocode_status == PENDING,
+            or_(Bodega.geocode_next_attempt_at.is_(None), Bodega.geocode_next_attempt_at <= datetime.utcnow())
+        ).order_by(Bodega.geocode_next_attempt_at, Bodega.id).limit(limit)
+    ))
+
+
+def retry_failed() -> int:
+    """
+    Queue every failed bodega for geocoding again, with its attempts reset
+
+    Returns:
+        int: Number of bodegas queued
+    """
+    result = db.session.execute(
+        update(Bodega).where(Bodega.geocode_status == FAILED).values(
+            geocode_status=PENDING,
+            geocode_attempts=0,
+            geocode_next_attempt_at=None,
+            updated_at=Bodega.updated_at
+        ).execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+class GeocodeWorker:
+    """
+    Thread pool resolving pending bodegas, fed by commits and a poller
+    """
+
+    def __init__(self, workers: int = DEFAULT_WORKERS, poll_interval: float = DEFAULT_POLL_INTERVAL):
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.app = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._queued: Set[int] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+
+    def init_app(self, app) -> None:
+        self.app = app
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='geocode-worker')
+            threading.Thread(target=self._poll, name='geocode-poller', daemon=True).start()
+
+    def submit(self, bodega_ids: List[int]) -> None:
+        """Queue bodegas for geocoding, skipping those already queued"""
+        if self._executor is None:
+            return
+        for bodega_id in bodega_ids:
+            with self._lock:
+                if bodega_id in self._queued:
+                    continue
+                self._queued.add(bodega_id)
+            self._executor.submit(self._resolve, bodega_id)
+
+    def _resolve(self, bodega_id: int) -> None:
+        try:
+            with self.app.app_context():
+                try:
+                    resolve(bodega_id)
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"Warning: geocoding bodega {bodega_id} failed: {e}")
+                finally:
+                    db.session.remove()
+        finally:
+            with self._lock:
+                self._queued.discard(bodega_id)
+
+    def _poll(self) -> None:
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    try:
+                        bodega_ids = due_bodega_ids()
+                    finally:
+                        db.session.remove()
+                self.submit(bodega_ids)
+            except Exception as e:
+                print(f"Warning: failed to scan for pending geocoding: {e}")
+
+
+geocode_worker = GeocodeWorker()
+
+
+def _newly_pending(bodega, action: str) -> Optional[int]:
+    # New bodegas, and ones whose address changed, become pending; retries do not change the status
+    if action == 'delete' or bodega.geocode_status != PENDING:
+        return None
+    if action == 'insert' or inspect(bodega).attrs.geocode_status.history.has_changes():
+        return bodega.id
+    return None
+
+
+# Start geocoding newly pending bodegas as soon as the write commits
+on_commit(
+    Bodega,
+    _newly_pending,
+    lambda bodega_ids: geocode_worker.submit([bodega_id for bodega_id in bodega_ids if bodega_id is not None])
+)
+
+
+@click.command('retry-failed-geocodes')
+@with_appcontext
+def retry_failed_command():
+    """Queue bodegas whose geocoding failed to be geocoded again."""
+    print(f"Queued {retry_failed()} bodega(s) for geocoding")
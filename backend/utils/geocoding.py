@@ -1,89 +1,244 @@
-import requests
+"""Geocoding through the Google Maps Geocoding API, cached in the geocode_cache table."""
+
 import os
-from typing import Optional, Tuple
+import re
+from datetime import datetime, timedelta
+from typing import Any, Callable, Optional, Tuple
 
-def geocode_address(address: str) -> Optional[Tuple[float, float]]:
+import requests
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db, GeocodeCache
+from utils.cache import LRUCache
+from utils.http import HTTPClient
+
+GOOGLE_BASE_URL = "https://maps.googleapis.com/maps/api/geocode"
+BASE_URL = os.getenv('GEOCODE_BASE_URL', GOOGLE_BASE_URL)
+
+# Seconds a result found by the provider is cached
+CACHE_TTL = float(os.getenv('GEOCODE_CACHE_TTL', 30 * 24 * 3600))
+# Seconds an address the provider found nothing for is cached
+NEGATIVE_CACHE_TTL = float(os.getenv('GEOCODE_NEGATIVE_CACHE_TTL', 24 * 3600))
+# Lookups also cached in memory, in front of the table
+MEMORY_CACHE_SIZE = int(os.getenv('GEOCODE_MEMORY_CACHE_SIZE', 4096))
+# Decimal places reverse lookups are rounded to; 4 is about 11 m
+REVERSE_PRECISION = int(os.getenv('GEOCODE_REVERSE_PRECISION', 4))
+
+_MISSING = object()
+
+
+class GeocodingUnavailable(Exception):
+    """Raised when the provider gave no definitive answer, e.g. it is down or no API key is set"""
+
+client = HTTPClient(
+    BASE_URL,
+    connect_timeout=float(os.getenv('GEOCODE_CONNECT_TIMEOUT', 2)),
+    read_timeout=float(os.getenv('GEOCODE_READ_TIMEOUT', 3)),
+    # Upper bound on one lookup, retries included
+    deadline=float(os.getenv('GEOCODE_DEADLINE', 5)),
+    retries=int(os.getenv('GEOCODE_RETRIES', 2)),
+    pool_size=int(os.getenv('GEOCODE_POOL_SIZE', 10)),
+    breaker_threshold=int(os.getenv('GEOCODE_BREAKER_THRESHOLD', 5)),
+    breaker_cooldown=float(os.getenv('GEOCODE_BREAKER_COOLDOWN', 30)),
+)
+
+
+def normalize_address(address: str) -> str:
+    """Lowercase, drop periods and collapse whitespace, so trivially different spellings share a key"""
+    address = address.lower().replace('.', ' ')
+    address = re.sub(r'\s*,\s*', ', ', address)
+    return ' '.join(address.split()).strip(', ')
+
+
+def reverse_key(lat: float, lng: float) -> str:
+    """Coordinates rounded to the reverse lookup grid, as 'lat,lng'"""
+    return f"{lat:.{REVERSE_PRECISION}f},{lng:.{REVERSE_PRECISION}f}"
+
+
+memory_cache = LRUCache(MEMORY_CACHE_SIZE)
+
+
+def _cached_value(kind: str, row) -> Any:
+    if not row.found:
+        return None
+    if kind == 'forward':
+        return (row.latitude, row.longitude)
+    return row.address
+
+
+def _load(kind: str, key: str) -> Any:
+    """Unexpired value stored for a lookup, or _MISSING"""
+    table = GeocodeCache.__table__
+    with db.engine.connect() as conn:
+        row = conn.execute(
+            select(table).where(table.c.kind == kind, table.c.key == key, table.c.expires_at > datetime.utcnow())
+        ).first()
+    if row is None:
+        return _MISSING
+
+    value = _cached_value(kind, row)
+    remaining = (row.expires_at - datetime.utcnow()).total_seconds()
+    memory_cache.set((kind, key), value, remaining)
+    return value
+
+
+def _store(kind: str, key: str, value: Any) -> None:
     """
-    Convert an address to latitude and longitude using Google Maps Geocoding API
-    
+    Cache a lookup in memory and in the table
+
+    The table is written on its own connection, so caching never commits or
+    rolls back the caller's session.
+    """
+    ttl = CACHE_TTL if value is not None else NEGATIVE_CACHE_TTL
+    memory_cache.set((kind, key), value, ttl)
+
+    values = {
+        'found': value is not None,
+        'latitude': value[0] if kind == 'forward' and value is not None else None,
+        'longitude': value[1] if kind == 'forward' and value is not None else None,
+        'address': value if kind == 'reverse' else None,
+        'created_at': datetime.utcnow(),
+        'expires_at': datetime.utcnow() + timedelta(seconds=ttl),
+    }
+    table = GeocodeCache.__table__
+    try:
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                update(table).where(table.c.kind == kind, table.c.key == key).values(**values)
+            ).rowcount
+            if not updated:
+                conn.execute(table.insert().values(kind=kind, key=key, **values))
+    except IntegrityError:
+        pass  # Stored by a concurrent lookup of the same key
+    except Exception as e:
+        print(f"Warning: failed to cache geocoding result for '{key}': {e}")
+
+
+def cached_lookup(kind: str, key: str, fetch: Callable[[], Tuple[Any, bool]]) -> Any:
+    """
+    Look a geocoding result up in memory, then in the table, then with the provider
+
     Args:
-        address (str): The address to geocode
-        
+        kind (str): 'forward' or 'reverse'
+        key (str): Normalized address or rounded coordinates
+        fetch: Asks the provider; returns the value, None if nothing was
+            found, and whether the answer is definitive enough to cache
+
+    Raises:
+        GeocodingUnavailable: If the provider gave no definitive answer
+    """
+    value = memory_cache.get((kind, key), _MISSING)
+    if value is not _MISSING:
+        return value
+
+    try:
+        value = _load(kind, key)
+    except Exception as e:
+        print(f"Warning: failed to read geocoding cache for '{key}': {e}")
+        value = _MISSING
+    if value is not _MISSING:
+        return value
+
+    value, definitive = fetch()
+    if not definitive:
+        raise GeocodingUnavailable(f"No definitive geocoding answer for '{key}'")
+    _store(kind, key, value)
+    return value
+
+
+def _request(params: dict, description: str) -> Tuple[Optional[dict], bool]:
+    """
+    Call the Geocoding API
+
     Returns:
-        Optional[Tuple[float, float]]: (latitude, longitude) or None if geocoding fails
+        Tuple[Optional[dict], bool]: The first result or None, and whether the
+        response is definitive (a result, or a clear "nothing found")
     """
     api_key = os.getenv('GOOGLE_MAPS_API_KEY')
-    if not api_key:
+    # A stand-in server configured through GEOCODE_BASE_URL needs no key
+    if not api_key and BASE_URL == GOOGLE_BASE_URL:
         print("Warning: GOOGLE_MAPS_API_KEY not found in environment variables")
-        return None
-    
-    # Add "New York City" to the address if it's not already there
-    if "new york" not in address.lower() and "nyc" not in address.lower():
-        address = f"{address}, New York City, NY"
-    
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {
-        'address': address,
-        'key': api_key
-    }
-    
+        return None, False
+
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
+        data = client.get_json('json', params={**params, 'key': api_key or ''})
+
         if data['status'] == 'OK' and data['results']:
-            location = data['results'][0]['geometry']['location']
-            return (location['lat'], location['lng'])
+            return data['results'][0], True
         else:
-            print(f"Geocoding failed for address '{address}': {data.get('status', 'Unknown error')}")
-            return None
-            
+            print(f"Geocoding failed for {description}: {data.get('status', 'Unknown error')}")
+            return None, data.get('status') == 'ZERO_RESULTS'
+
     except requests.RequestException as e:
-        print(f"Error geocoding address '{address}': {e}")
-        return None
+        print(f"Error geocoding {description}: {e}")
+        return None, False
     except Exception as e:
-        print(f"Unexpected error geocoding address '{address}': {e}")
+        print(f"Unexpected error geocoding {description}: {e}")
+        return None, False
+
+
+def lookup_address(address: str) -> Optional[Tuple[float, float]]:
+    """
+    Convert an address to latitude and longitude, telling "not found" apart from failures
+
+    Returns:
+        Optional[Tuple[float, float]]: (latitude, longitude) or None if the address was not found
+
+    Raises:
+        GeocodingUnavailable: If the provider could not be asked or gave no definitive answer
+    """
+    # Add "New York City" to the address if it's not already there
+    if "new york" not in address.lower() and "nyc" not in address.lower():
+        address = f"{address}, New York City, NY"
+
+    def fetch():
+        result, definitive = _request({'address': address}, f"address '{address}'")
+        if result is None:
+            return None, definitive
+        location = result['geometry']['location']
+        return (location['lat'], location['lng']), True
+
+    return cached_lookup('forward', normalize_address(address), fetch)
+
+
+def geocode_address(address: str) -> Optional[Tuple[float, float]]:
+    """
+    Convert an address to latitude and longitude using Google Maps Geocoding API
+
+    Args:
+        address (str): The address to geocode
+
+    Returns:
+        Optional[Tuple[float, float]]: (latitude, longitude) or None if geocoding fails
+    """
+    try:
+        return lookup_address(address)
+    except GeocodingUnavailable:
         return None
 
+
 def reverse_geocode(lat: float, lng: float) -> Optional[str]:
     """
     Convert latitude and longitude to an address using Google Maps Geocoding API
-    
+
     Args:
         lat (float): Latitude
         lng (float): Longitude
-        
+
     Returns:
         Optional[str]: Formatted address or None if reverse geocoding fails
     """
-    api_key = os.getenv('GOOGLE_MAPS_API_KEY')
-    if not api_key:
-        print("Warning: GOOGLE_MAPS_API_KEY not found in environment variables")
-        return None
-    
-    url = "https://maps.googleapis.com/maps/api/geocode/json"
-    params = {
-        'latlng': f"{lat},{lng}",
-        'key': api_key
-    }
-    
+    key = reverse_key(lat, lng)
+
+    def fetch():
+        # Asking for the grid point keeps the cached answer the same for every point near it
+        result, definitive = _request({'latlng': key}, f"coordinates ({lat}, {lng})")
+        if result is None:
+            return None, definitive
+        return result['formatted_address'], True
+
     try:
-        response = requests.get(url, params=params, timeout=10)
-        response.raise_for_status()
-        
-        data = response.json()
-        
-        if data['status'] == 'OK' and data['results']:
-            return data['results'][0]['formatted_address']
-        else:
-            print(f"Reverse geocoding failed for coordinates ({lat}, {lng}): {data.get('status', 'Unknown error')}")
-            return None
-            
-    except requests.RequestException as e:
-        print(f"Error reverse geocoding coordinates ({lat}, {lng}): {e}")
+        return cached_lookup('reverse', key, fetch)
+    except GeocodingUnavailable:
         return None
-    except Exception as e:
-        print(f"Unexpected error reverse geocoding coordinates ({lat}, {lng}): {e}")
-        return None 
\ No newline at end of file
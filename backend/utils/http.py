@@ -0,0 +1,128 @@
+"""Pooled, retrying HTTP client with a circuit breaker for external APIs."""
+
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class CircuitOpenError(requests.RequestException):
+    """Raised instead of calling a provider that is failing"""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker
+
+    Closed: calls go through. After `threshold` consecutive failures it opens
+    and calls fail fast for `cooldown` seconds. Then it lets one call through
+    (half-open); success closes it, failure opens it for another cooldown.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial_running or time.monotonic() - self._opened_at < self.cooldown:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.threshold:
+                if self._opened_at is None:
+                    print(f"Warning: circuit opened after {self._failures} consecutive failures")
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+class HTTPClient:
+    """
+    Pooled, retrying JSON client for one API base URL
+    """
+
+    def __init__(self, base_url: str, connect_timeout: float = 2, read_timeout: float = 3,
+                 deadline: float = 5, retries: int = 2, backoff: float = 0.2, pool_size: int = 10,
+                 breaker_threshold: int = 5, breaker_cooldown: float = 30):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.deadline = deadline
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_cooldown)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get_json(self, path: str, params: Optional[dict] = None) -> dict:
+        """
+        GET base_url + path and decode the JSON response
+
+        Raises:
+            CircuitOpenError: If the circuit is open
+            requests.RequestException: If every attempt failed or the deadline passed
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError(f"{self.base_url} is unavailable, not retrying until the cooldown passes")
+
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            remaining = self.deadline - (time.monotonic() - started)
+            try:
+                if remaining <= 0:
+                    raise requests.Timeout(f"Deadline of {self.deadline}s exceeded")
+                response = self.session.get(
+                    url, params=params,
+                    timeout=(min(self.connect_timeout, remaining), min(self.read_timeout, remaining))
+                )
+                if response.status_code in RETRY_STATUSES:
+                    raise requests.HTTPError(f"{response.status_code} from {url}", response=response)
+                response.raise_for_status()
+                data = response.json()
+            except (requests.ConnectionError, requests.Timeout, requests.HTTPError) as e:
+                retryable = not isinstance(e, requests.HTTPError) or e.response.status_code in RETRY_STATUSES
+                delay = self.backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                out_of_time = time.monotonic() - started + delay >= self.deadline
+                if not retryable or attempt >= self.retries or out_of_time:
+                    self.breaker.record_failure()
+                    raise
+                attempt += 1
+                time.sleep(delay)
+                continue
+            except Exception:
+                self.breaker.record_failure()
+                raise
+
+            self.breaker.record_success()
+            return data
@@ -0,0 +1,19 @@
+"""
+Helpers for telling integrity errors apart.
+"""
+
+from sqlalchemy.exc import IntegrityError
+
+# SQLSTATE for unique_violation
+UNIQUE_VIOLATION = '23505'
+
+
+def is_unique_violation(error: IntegrityError) -> bool:
+    """
+    Whether an IntegrityError was raised by a unique index or constraint,
+    as opposed to e.g. a foreign key or NOT NULL violation
+    """
+    code = getattr(error.orig, 'pgcode', None) or getattr(error.orig, 'sqlstate', None)
+    if code:
+        return code == UNIQUE_VIOLATION
+    return 'UNIQUE constraint failed' in str(error.orig)
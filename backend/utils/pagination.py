@@ -0,0 +1,190 @@
+import base64
+import bisect
+import json
+import math
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import and_, or_
+from sqlalchemy.types import DateTime
+
+from utils.counts import TOTAL_MODES, total_for
+
+# Largest page a cursor request may ask for
+MAX_PER_PAGE = 100
+
+def encode_cursor(values: List) -> str:
+    """
+    Encode the sort key of the last returned row as an opaque cursor string
+    
+    Args:
+        values (List): JSON-serializable sort key values
+        
+    Returns:
+        str: URL-safe cursor
+    """
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    payload = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(payload).decode().rstrip('=')
+
+def decode_cursor(cursor: Optional[str], length: int) -> Optional[List]:
+    """
+    Decode a cursor produced by encode_cursor
+    
+    Args:
+        cursor (Optional[str]): Cursor from the request, or None
+        length (int): Number of sort key values the cursor must contain
+        
+    Returns:
+        Optional[List]: The sort key values, or None if no cursor was given
+        
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    if not cursor:
+        return None
+    
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+    
+    if not isinstance(values, list) or len(values) != length:
+        raise ValueError("Invalid cursor")
+    return values
+
+def paginate_keys(keys: List[Tuple], cursor: Optional[str], limit: int) -> Tuple[List[Tuple], Optional[str]]:
+    """
+    Slice a sorted list of sort keys to the page following the cursor
+    
+    Args:
+        keys (List[Tuple]): Numeric sort keys in ascending order, e.g. (distance, id)
+        cursor (Optional[str]): Cursor of the previous page's last key
+        limit (int): Maximum number of keys in the page
+        
+    Returns:
+        Tuple[List[Tuple], Optional[str]]: The page of keys and the cursor for the next page
+        
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    after = decode_cursor(cursor, len(keys[0]) if keys else 2)
+    if after and not all(isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+                         for value in after):
+        raise ValueError("Invalid cursor")
+    start = bisect.bisect_right(keys, tuple(after)) if after else 0
+    page = keys[start:start + limit]
+    next_cursor = encode_cursor(list(page[-1])) if start + limit < len(keys) else None
+    return page, next_cursor
+
+
+def _keyset_filter(order: List[Tuple[Any, bool]], after: List):
+    # Rows strictly after the cursor: equal on a prefix of the keys, then past it on the next
+    clauses = []
+    for i, (expression, descending) in enumerate(order):
+        past = expression < after[i] if descending else expression > after[i]
+        clauses.append(and_(*[order[j][0] == after[j] for j in range(i)], past))
+    return or_(*clauses)
+
+def paginate_query(query, order: List[Tuple[Any, bool]], cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """
+    Fetch the page of a query following the cursor, seeking on the sort key
+    
+    The keyset filter lets the database start reading at the cursor through
+    the index on the sort key, so every page costs the same and no COUNT is
+    run.
+    
+    Args:
+        query: Query returning a single entity
+        order (List[Tuple[Any, bool]]): (expression, descending) pairs; must be
+            non-null and end with a unique key such as the primary key
+        cursor (Optional[str]): Cursor of the previous page's last row
+        limit (int): Maximum number of rows in the page
+        
+    Returns:
+        Tuple[List, Optional[str]]: The page of rows and the cursor for the next page
+        
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    after = decode_cursor(cursor, len(order))
+    if after:
+        try:
+            after = [datetime.fromisoformat(value) if isinstance(expression.type, DateTime) else value
+                     for (expression, _), value in zip(order, after)]
+        except (TypeError, ValueError):
+            raise ValueError("Invalid cursor")
+        if any(value is None or isinstance(value, (list, dict)) for value in after):
+            raise ValueError("Invalid cursor")
+        query = query.filter(_keyset_filter(order, after))
+    
+    expressions = [expression for expression, _ in order]
+    rows = query.order_by(None).order_by(
+        *[expression.desc() if descending else expression.asc() for expression, descending in order]
+    ).add_columns(*expressions).limit(limit + 1).all()
+    
+    page = rows[:limit]
+    next_cursor = encode_cursor(list(page[-1][1:])) if len(rows) > limit else None
+    return [row[0] for row in page], next_cursor
+
+def paginate_list(query, order: List[Tuple[Any, bool]], args, default_per_page: int = 20,
+                  counter=None) -> Tuple[List, dict]:
+    """
+    Page a list query from the request arguments
+    
+    Requests with ?page= keep the original offset paging with totals; all
+    others are paged by cursor with ?after= and only include a total when
+    one is asked for. ?total=exact|estimate|none picks how the total is
+    found (see utils.counts).
+    
+    Args:
+        query: Query returning a single entity
+        order (List[Tuple[Any, bool]]): Sort key, as for paginate_query
+        args: Request query arguments
+        default_per_page (int): Page size when per_page is not given
+        counter (Optional[Counter]): Counter holding the total when the query is unfiltered
+        
+    Returns:
+        Tuple[List, dict]: The page of rows and the pagination block for the response
+        
+    Raises:
+        ValueError: If per_page, total or the cursor is invalid
+    """
+    page = args.get('page', type=int)
+    per_page = args.get('per_page', default_per_page, type=int)
+    total_mode = args.get('total', 'exact' if page is not None else 'none')
+    
+    if total_mode not in TOTAL_MODES:
+        raise ValueError("total must be one of: " + ', '.join(TOTAL_MODES))
+    
+    if page is not None:
+        ordered = query.order_by(None).order_by(
+            *[expression.desc() if descending else expression.asc() for expression, descending in order]
+        )
+        pagination = ordered.paginate(page=page, per_page=per_page, error_out=False, count=False)
+        total, estimated = total_for(query, total_mode, counter)
+        result = {
+            'page': page,
+            'per_page': per_page,
+            'total': total,
+            'pages': math.ceil(total / pagination.per_page) if total is not None else None
+        }
+        if total_mode == 'estimate':
+            result['total_estimated'] = estimated
+        return pagination.items, result
+    
+    if per_page < 1:
+        raise ValueError("per_page must be positive")
+    per_page = min(per_page, MAX_PER_PAGE)
+    
+    items, next_cursor = paginate_query(query, order, args.get('after'), per_page)
+    result = {
+        'per_page': per_page,
+        'next_cursor': next_cursor
+    }
+    if total_mode != 'none':
+        result['total'], estimated = total_for(query, total_mode, counter)
+        if total_mode == 'estimate':
+            result['total_estimated'] = estimated
+    return items, result
\ No newline at end of file
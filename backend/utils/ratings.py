@@ -0,0 +1,82 @@
+"""Rating aggregates of cats and bodegas, adjusted by deltas as reviews are written."""
+
+import os
+from typing import Dict, Optional
+
+from sqlalchemy import Float, case, cast, func, update
+
+from models import db, Cat, Bodega
+
+STARS = range(1, 6)
+
+# Bayesian prior: every item starts as if it had PRIOR_WEIGHT reviews averaging PRIOR_MEAN
+PRIOR_MEAN = float(os.getenv('RATING_PRIOR_MEAN', 3.0))
+PRIOR_WEIGHT = float(os.getenv('RATING_PRIOR_WEIGHT', 5))
+
+
+def histogram_column(model, stars: int):
+    return getattr(model, f'rating_count_{stars}')
+
+
+def rating_histogram(item) -> Dict[str, int]:
+    """Number of reviews per star rating of a cat or bodega, keyed '1' to '5'"""
+    return {str(stars): getattr(item, f'rating_count_{stars}') or 0 for stars in STARS}
+
+
+def bayesian_score(model):
+    """
+    SQL expression for the Bayesian-weighted rating of a cat or bodega
+
+    Items with few reviews are pulled towards the prior mean, so a single
+    five-star review does not outrank a hundred four-star ones. The score is
+    computed from the row's own columns and needs no aggregation.
+    """
+    return (
+        (PRIOR_MEAN * PRIOR_WEIGHT + cast(func.coalesce(model.rating_sum, 0), Float)) /
+        (PRIOR_WEIGHT + func.coalesce(model.review_count, 0))
+    )
+
+
+def adjust_rating(model, item_id: int, removed: Optional[int], added: Optional[int]) -> None:
+    """
+    Move one review's rating out of and/or into the aggregates of a cat or
+    bodega and recompute its average from the new values
+    """
+    rating_delta = (added or 0) - (removed or 0)
+    count_delta = (added is not None) - (removed is not None)
+    rating_sum = func.coalesce(model.rating_sum, 0) + rating_delta
+    review_count = func.coalesce(model.review_count, 0) + count_delta
+
+    values = {
+        'rating_sum': rating_sum,
+        'review_count': review_count,
+        'rating': case((review_count > 0, cast(rating_sum, Float) / review_count), else_=0.0)
+    }
+    for stars, delta in ((removed, -1), (added, 1)):
+        if stars is not None:
+            column = histogram_column(model, stars)
+            values[column.key] = values.get(column.key, func.coalesce(column, 0)) + delta
+
+    db.session.execute(
+        update(model).where(model.id == item_id).values(**values).execution_options(synchronize_session=False)
+    )
+
+
+def apply_review_change(cat_id: Optional[int], bodega_id: Optional[int],
+                        removed: Optional[int] = None, added: Optional[int] = None) -> None:
+    """
+    Update the aggregates of whatever a review is about
+
+    Args:
+        cat_id (Optional[int]): Reviewed cat, if any
+        bodega_id (Optional[int]): Reviewed bodega, if any
+        removed (Optional[int]): Rating taken away, on update or delete
+        added (Optional[int]): Rating given, on create or update
+    """
+    if removed == added:
+        return
+
+    if cat_id:
+        adjust_rating(Cat, cat_id, removed, added)
+    if bodega_id:
+        adjust_rating(Bodega, bodega_id, removed, added)
@@ -0,0 +1,145 @@
+"""Reconciliation of denormalized aggregates against their source rows."""
+
+from typing import Dict, List, Tuple
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, case, func, select, update
+
+from models import db, Cat, Bodega, Review
+from utils.ratings import STARS
+
+DEFAULT_BATCH_SIZE = 10000
+
+RATING_COLUMNS = ['review_count', 'rating_sum'] + [f'rating_count_{stars}' for stars in STARS]
+
+
+def _review_aggregates(key, low: int, high: int) -> Dict[int, Dict[str, int]]:
+    """Review count, rating sum and histogram per target id in [low, high)"""
+    rows = db.session.execute(
+        select(
+            key,
+            func.count(),
+            func.sum(Review.rating),
+            *[func.sum(case((Review.rating == stars, 1), else_=0)) for stars in STARS]
+        ).where(key >= low, key < high).group_by(key)
+    ).all()
+    return {row[0]: dict(zip(RATING_COLUMNS, (int(value or 0) for value in row[1:]))) for row in rows}
+
+
+def _cat_counts(low: int, high: int) -> Dict[int, Dict[str, int]]:
+    rows = db.session.execute(
+        select(Cat.bodega_id, func.count()).where(Cat.bodega_id >= low, Cat.bodega_id < high).group_by(Cat.bodega_id)
+    ).all()
+    return {bodega_id: {'cat_count': count} for bodega_id, count in rows}
+
+
+def _expected_rating(values: Dict[str, int]) -> float:
+    return values['rating_sum'] / values['review_count'] if values['review_count'] else 0.0
+
+
+def _reconcile_batch(model, columns: List[str], expected_for, low: int, high: int, fix: bool) -> Tuple[int, int, int]:
+    """
+    Compare and optionally correct the rows of one id range
+
+    Returns:
+        Tuple[int, int, int]: Rows checked, drifted and corrected
+    """
+    table = model.__table__
+    compare_rating = 'rating_sum' in columns
+
+    # Stored values are read first, so a review written in between changes the row and
+    # the conditional update below leaves it for the next run
+    stored = db.session.execute(
+        select(table.c.id, *[table.c[column] for column in columns + (['rating'] if compare_rating else [])])
+        .where(table.c.id >= low, table.c.id < high)
+    ).all()
+    expected = expected_for(low, high)
+
+    corrections = []
+    for row in stored:
+        current = dict(row._mapping)
+        target = expected.get(row.id, dict.fromkeys(columns, 0))
+        values = {column: target[column] for column in columns}
+        if compare_rating:
+            values['rating'] = _expected_rating(target)
+
+        if all(current[column] == values[column] for column in columns) and (
+            not compare_rating or current['rating'] is not None and abs(current['rating'] - values['rating']) < 1e-9
+        ):
+            continue
+
+        corrections.append({
+            'b_id': row.id,
+            **{f'old_{column}': value for column, value in current.items() if column != 'id'},
+            **{f'new_{column}': value for column, value in values.items()}
+        })
+
+    corrected = 0
+    if fix and corrections:
+        compared = [column for column in stored[0]._mapping if column != 'id']
+        statement = update(table).where(
+            table.c.id == bindparam('b_id'),
+            *[table.c[column].is_not_distinct_from(bindparam(f'old_{column}')) for column in compared]
+        ).values(
+            updated_at=table.c.updated_at,
+            **{column: bindparam(f'new_{column}') for column in compared}
+        )
+        corrected = db.session.execute(statement, corrections).rowcount
+
+    if fix:
+        db.session.commit()
+    else:
+        db.session.rollback()
+    return len(stored), len(corrections), corrected
+
+
+def reconcile(model, columns: List[str], expected_for, fix: bool = False,
+              batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Reconcile one set of aggregate columns of a table, batch by batch of ids
+
+    Returns:
+        Dict[str, int]: Rows checked, drifted and corrected
+    """
+    low_id, high_id = db.session.execute(select(func.min(model.id), func.max(model.id))).one()
+    db.session.rollback()
+
+    report = {'checked': 0, 'drifted': 0, 'corrected': 0}
+    if low_id is None:
+        return report
+
+    for low in range(low_id, high_id + 1, batch_size):
+        checked, drifted, corrected = _reconcile_batch(model, columns, expected_for, low, low + batch_size, fix)
+        report['checked'] += checked
+        report['drifted'] += drifted
+        report['corrected'] += corrected
+    return report
+
+
+def reconcile_aggregates(fix: bool = False, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Dict[str, int]]:
+    """
+    Check every denormalized aggregate, correcting drift when fix is set
+
+    Returns:
+        Dict[str, Dict[str, int]]: Report per aggregate
+    """
+    return {
+        'cat_ratings': reconcile(
+            Cat, RATING_COLUMNS, lambda low, high: _review_aggregates(Review.cat_id, low, high), fix, batch_size
+        ),
+        'bodega_ratings': reconcile(
+            Bodega, RATING_COLUMNS, lambda low, high: _review_aggregates(Review.bodega_id, low, high), fix, batch_size
+        ),
+        'bodega_cat_counts': reconcile(Bodega, ['cat_count'], _cat_counts, fix, batch_size),
+    }
+
+
+@click.command('reconcile-aggregates')
+@click.option('--fix', is_flag=True, help='Correct drifted rows instead of only reporting them.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Ids per batch.')
+@with_appcontext
+def reconcile_command(fix, batch_size):
+    """Recompute ratings, review counts and cat counts and report drift."""
+    for name, report in reconcile_aggregates(fix, batch_size).items():
+        print(f"{name}: {report['checked']} checked, {report['drifted']} drifted, {report['corrected']} corrected")
@@ -0,0 +1,125 @@
+"""Saved state of many cats and bodegas at once, and bulk save and unsave."""
+
+from typing import Dict, List, Set
+
+from models import db, Cat, Bodega, SavedCat, SavedBodega
+
+# Ids of each type accepted by one lookup or bulk change
+MAX_IDS = 100
+
+# Per id parameter: response key, saved model, its item column and the item model
+SAVED_TYPES = {
+    'cat_ids': ('cats', SavedCat, SavedCat.cat_id, Cat),
+    'bodega_ids': ('bodegas', SavedBodega, SavedBodega.bodega_id, Bodega),
+}
+
+
+def parse_ids(value, name: str) -> List[int]:
+    """
+    Ids from a comma-separated query parameter or a JSON list, deduplicated in order
+
+    Raises:
+        ValueError: If the ids are malformed or too many
+    """
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+
+    try:
+        if not isinstance(value, list) or any(isinstance(item, bool) for item in value):
+            raise TypeError
+        ids = [int(item) for item in value]
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a list of ids")
+
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MAX_IDS:
+        raise ValueError(f"At most {MAX_IDS} {name} are allowed")
+    return ids
+
+
+def saved_ids(user_id: int, name: str, ids: List[int]) -> Set[int]:
+    """Which of the given item ids the user has saved"""
+    if not ids:
+        return set()
+    _, model, column, _ = SAVED_TYPES[name]
+    return set(db.session.scalars(
+        db.select(column).where(model.user_id == user_id, column.in_(ids))
+    ))
+
+
+def saved_state(user_id: int, ids: Dict[str, List[int]]) -> Dict[str, Dict[str, bool]]:
+    """
+    Saved flag of every requested id, keyed by item type and then id
+
+    Args:
+        user_id (int): The user
+        ids (Dict[str, List[int]]): Ids per item type, 'cat_ids' and 'bodega_ids'
+    """
+    state = {}
+    for name, item_ids in ids.items():
+        saved = saved_ids(user_id, name, item_ids)
+        state[SAVED_TYPES[name][0]] = {str(item_id): item_id in saved for item_id in item_ids}
+    return state
+
+
+def bulk_save(user_id: int, ids: Dict[str, List[int]]) -> Dict[str, Dict[str, List[int]]]:
+    """
+    Save every given item the user has not saved yet; the caller commits
+
+    Returns:
+        Dict[str, Dict[str, List[int]]]: Newly saved and missing ids per item type
+    """
+    result = {'saved': {}, 'not_found': {}}
+    for name, item_ids in ids.items():
+        _, model, column, item_model = SAVED_TYPES[name]
+        already = saved_ids(user_id, name, item_ids)
+        pending = [item_id for item_id in item_ids if item_id not in already]
+        existing = set(db.session.scalars(
+            db.select(item_model.id).where(item_model.id.in_(pending))
+        )) if pending else set()
+
+        new_ids = [item_id for item_id in pending if item_id in existing]
+        db.session.add_all([model(user_id=user_id, **{column.key: item_id}) for item_id in new_ids])
+        result['saved'][name] = new_ids
+        result['not_found'][name] = [item_id for item_id in pending if item_id not in existing]
+
+    db.session.flush()
+    return result
+
+
+def bulk_unsave(user_id: int, ids: Dict[str, List[int]]) -> Dict[str, Dict[str, List[int]]]:
+    """
+    Remove every given item from the user's saved items; the caller commits
+
+    Returns:
+        Dict[str, Dict[str, List[int]]]: Removed ids per item type
+    """
+    result = {'removed': {}}
+    for name, item_ids in ids.items():
+        _, model, column, _ = SAVED_TYPES[name]
+        rows = model.query.filter(model.user_id == user_id, column.in_(item_ids)).all() if item_ids else []
+        for row in rows:
+            db.session.delete(row)
+        removed = {getattr(row, column.key) for row in rows}
+        result['removed'][name] = [item_id for item_id in item_ids if item_id in removed]
+
+    db.session.flush()
+    return result
+
+
+def request_ids(source, required: bool = False) -> Dict[str, List[int]]:
+    """
+    cat_ids and bodega_ids from query parameters or a JSON body
+
+    Raises:
+        ValueError: If the ids are malformed, or none are given when required
+    """
+    if not hasattr(source, 'get'):
+        raise ValueError("cat_ids or bodega_ids is required")
+
+    ids = {name: parse_ids(source.get(name), name) for name in SAVED_TYPES}
+    if required and not any(ids.values()):
+        raise ValueError("cat_ids or bodega_ids is required")
+    return ids
@@ -0,0 +1,200 @@
+"""Response serializers and the eager-loading options that feed them."""
+
+from sqlalchemy.orm import configure_mappers, contains_eager, joinedload, selectinload
+
+from models import Cat, Bodega, Review, SavedCat, SavedBodega, RecentlyViewed
+from utils.ratings import rating_histogram
+
+# Backref attributes such as Cat.bodega only exist once the mappers are configured
+configure_mappers()
+
+CAT_LIST_OPTIONS = (
+    joinedload(Cat.bodega),
+)
+
+CAT_DETAIL_OPTIONS = (
+    joinedload(Cat.bodega),
+    joinedload(Cat.creator),
+    selectinload(Cat.photos),
+)
+
+BODEGA_LIST_OPTIONS = ()
+
+BODEGA_DETAIL_OPTIONS = (
+    joinedload(Bodega.creator),
+    selectinload(Bodega.photos),
+    selectinload(Bodega.cats),
+)
+
+REVIEW_LIST_OPTIONS = (
+    joinedload(Review.user),
+)
+
+USER_REVIEW_LIST_OPTIONS = (
+    joinedload(Review.cat),
+    joinedload(Review.bodega),
+)
+
+# Columns read by serialize_cat and serialize_bodega
+CAT_SUMMARY_COLUMNS = (
+    Cat.id, Cat.name, Cat.bodega_id, Cat.description, Cat.age, Cat.breed, Cat.sex, Cat.personality,
+    Cat.color, Cat.weight, Cat.is_friendly, Cat.rating, Cat.review_count, Cat.primary_photo_filename,
+)
+CAT_BODEGA_COLUMNS = (Bodega.id, Bodega.name, Bodega.address, Bodega.latitude, Bodega.longitude)
+BODEGA_SUMMARY_COLUMNS = CAT_BODEGA_COLUMNS + (
+    Bodega.description, Bodega.phone, Bodega.hours, Bodega.rating, Bodega.review_count,
+    Bodega.cat_count, Bodega.is_verified, Bodega.primary_photo_filename,
+)
+
+# The options below fill relationships from joins the query must make itself
+
+# For queries joining SavedCat.cat
+SAVED_CAT_OPTIONS = (
+    contains_eager(SavedCat.cat).load_only(*CAT_SUMMARY_COLUMNS)
+    .joinedload(Cat.bodega).load_only(*CAT_BODEGA_COLUMNS),
+)
+
+# For queries joining SavedBodega.bodega
+SAVED_BODEGA_OPTIONS = (
+    contains_eager(SavedBodega.bodega).load_only(*BODEGA_SUMMARY_COLUMNS),
+)
+
+# For queries joining RecentlyViewed.cat
+RECENTLY_VIEWED_CAT_OPTIONS = (
+    contains_eager(RecentlyViewed.cat).load_only(*CAT_SUMMARY_COLUMNS)
+    .joinedload(Cat.bodega).load_only(*CAT_BODEGA_COLUMNS),
+)
+
+# For queries outer joining both RecentlyViewed.cat and RecentlyViewed.bodega
+RECENTLY_VIEWED_OPTIONS = RECENTLY_VIEWED_CAT_OPTIONS + (
+    contains_eager(RecentlyViewed.bodega).load_only(*BODEGA_SUMMARY_COLUMNS),
+)
+
+
+def serialize_photo(photo) -> dict:
+    return {
+        'id': photo.id,
+        'filename': photo.filename,
+        'caption': photo.caption,
+        'is_primary': photo.is_primary
+    }
+
+
+def serialize_cat(cat, **extra) -> dict:
+    """Cat summary used by list views; extra keys are merged in"""
+    return {
+        'id': cat.id,
+        'name': cat.name,
+        'bodega_id': cat.bodega_id,
+        'bodega_name': cat.bodega.name,
+        'address': cat.bodega.address,
+        'latitude': cat.bodega.latitude,
+        'longitude': cat.bodega.longitude,
+        'description': cat.description,
+        'age': cat.age,
+        'breed': cat.breed,
+        'sex': cat.sex,
+        'personality': cat.personality,
+        'color': cat.color,
+        'weight': cat.weight,
+        'is_friendly': cat.is_friendly,
+        'rating': cat.rating,
+        'review_count': cat.review_count,
+        'primary_photo': cat.primary_photo_filename,
+        **extra
+    }
+
+
+def serialize_cat_detail(cat) -> dict:
+    return serialize_cat(
+        cat,
+        created_by=cat.created_by,
+        creator_username=cat.creator.username if cat.creator else None,
+        rating_histogram=rating_histogram(cat),
+        photos=[serialize_photo(photo) for photo in cat.photos]
+    )
+
+
+def serialize_bodega_cat(cat) -> dict:
+    """Cat entry nested inside a bodega, without the bodega fields"""
+    return {
+        'id': cat.id,
+        'name': cat.name,
+        'description': cat.description,
+        'age': cat.age,
+        'breed': cat.breed,
+        'sex': cat.sex,
+        'personality': cat.personality,
+        'color': cat.color,
+        'weight': cat.weight,
+        'is_friendly': cat.is_friendly,
+        'rating': cat.rating,
+        'review_count': cat.review_count,
+        'primary_photo': cat.primary_photo_filename
+    }
+
+
+def serialize_bodega(bodega, **extra) -> dict:
+    """Bodega summary used by list views; extra keys are merged in"""
+    return {
+        'id': bodega.id,
+        'name': bodega.name,
+        'address': bodega.address,
+        'latitude': bodega.latitude,
+        'longitude': bodega.longitude,
+        'description': bodega.description,
+        'phone': bodega.phone,
+        'hours': bodega.hours,
+        'rating': bodega.rating,
+        'review_count': bodega.review_count,
+        'cat_count': bodega.cat_count,
+        'is_verified': bodega.is_verified,
+        'primary_photo': bodega.primary_photo_filename,
+        **extra
+    }
+
+
+def serialize_bodega_detail(bodega) -> dict:
+    return serialize_bodega(
+        bodega,
+        created_by=bodega.created_by,
+        creator_username=bodega.creator.username if bodega.creator else None,
+        rating_histogram=rating_histogram(bodega),
+        geocode_status=bodega.geocode_status,
+        cats=[serialize_bodega_cat(cat) for cat in bodega.cats if cat.is_active],
+        photos=[serialize_photo(photo) for photo in bodega.photos]
+    )
+
+
+def serialize_review(review) -> dict:
+    """Review with its author, as listed on a cat or bodega"""
+    return {
+        'id': review.id,
+        'rating': review.rating,
+        'comment': review.comment,
+        'user': {
+            'id': review.user.id,
+            'username': review.user.username
+        },
+        'created_at': review.created_at.isoformat(),
+        'updated_at': review.updated_at.isoformat()
+    }
+
+
+def serialize_user_review(review) -> dict:
+    """Review with its subject, as listed for the user who wrote it"""
+    return {
+        'id': review.id,
+        'rating': review.rating,
+        'comment': review.comment,
+        'cat': {
+            'id': review.cat.id,
+            'name': review.cat.name
+        } if review.cat else None,
+        'bodega': {
+            'id': review.bodega.id,
+            'name': review.bodega.name
+        } if review.bodega else None,
+        'created_at': review.created_at.isoformat(),
+        'updated_at': review.updated_at.isoformat()
+    }
@@ -0,0 +1,384 @@
+"""Spatial grid index over bodega locations."""
+
+import itertools
+import math
+import os
+import threading
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+from models import db, Bodega
+from utils.cache import LRUCache
+from utils.commit_hooks import on_commit
+
+EARTH_RADIUS_KM = 6371
+KM_PER_DEGREE_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+# 0.01 degrees is roughly 1.1 km north-south and 0.85 km east-west in NYC
+DEFAULT_CELL_SIZE = float(os.getenv('SPATIAL_INDEX_CELL_SIZE', 0.01))
+# Radius the nearest-neighbour search starts from before doubling outward
+INITIAL_SEARCH_RADIUS = 0.5
+# Seconds before a loaded cell is read again from the database
+DEFAULT_TTL = float(os.getenv('SPATIAL_INDEX_TTL', 300))
+# Largest radius in km a nearby or nearest search may cover
+MAX_SEARCH_RADIUS = 50
+# Cells are loaded in square blocks of this many cells per side
+BLOCK_CELLS = 16
+# Loaded blocks remembered
+MAX_LOADED_BLOCKS = 4096
+
+
+def haversine_distances(lat: float, lng: float, lat_rad: np.ndarray, lng_rad: np.ndarray) -> np.ndarray:
+    """
+    Great-circle distances in kilometers from (lat, lng) to arrays of points given in radians
+    """
+    lat0 = math.radians(lat)
+    lng0 = math.radians(lng)
+
+    a = np.sin((lat_rad - lat0) / 2) ** 2 + math.cos(lat0) * np.cos(lat_rad) * np.sin((lng_rad - lng0) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def bounding_box(lat: float, lng: float, radius_km: float) -> Tuple[float, float, float, float]:
+    """
+    Smallest lat/lng rectangle containing every point within radius_km of (lat, lng)
+
+    Returns:
+        Tuple[float, float, float, float]: (min_lat, min_lng, max_lat, max_lng)
+    """
+    dlat = radius_km / KM_PER_DEGREE_LAT
+    # Use the latitude furthest from the equator so the box covers the circle
+    max_abs_lat = min(abs(lat) + dlat, 89.9)
+    dlng = min(dlat / math.cos(math.radians(max_abs_lat)), 180.0)
+    return (lat - dlat, lng - dlng, lat + dlat, lng + dlng)
+
+
+def parse_bbox(value: Optional[str]) -> Tuple[float, float, float, float]:
+    """
+    Parse a "min_lat,min_lng,max_lat,max_lng" query parameter
+
+    Raises:
+        ValueError: If the box is missing, malformed or out of range
+    """
+    try:
+        min_lat, min_lng, max_lat, max_lng = (float(part) for part in (value or '').split(','))
+    except ValueError:
+        raise ValueError("bbox must be min_lat,min_lng,max_lat,max_lng")
+
+    return check_bbox(min_lat, min_lng, max_lat, max_lng)
+
+
+def check_bbox(min_lat: Optional[float], min_lng: Optional[float],
+               max_lat: Optional[float], max_lng: Optional[float]) -> Tuple[float, float, float, float]:
+    """
+    Validate the corners of a bounding box
+
+    Raises:
+        ValueError: If a corner is missing or the box is out of range
+    """
+    if None in (min_lat, min_lng, max_lat, max_lng):
+        raise ValueError("min_lat, min_lng, max_lat and max_lng are required")
+
+    if not (-90 <= min_lat <= max_lat <= 90 and -180 <= min_lng <= max_lng <= 180):
+        raise ValueError("bbox is out of range")
+    return (min_lat, min_lng, max_lat, max_lng)
+
+
+def check_radius(radius_km: float) -> float:
+    """
+    Validate a search radius in kilometers
+
+    Raises:
+        ValueError: If the radius is not positive or above MAX_SEARCH_RADIUS
+    """
+    if not 0 < radius_km <= MAX_SEARCH_RADIUS:
+        raise ValueError(f"radius must be between 0 and {MAX_SEARCH_RADIUS} km")
+    return radius_km
+
+
+class SpatialGrid:
+    """
+    Fixed-cell grid over points stored in contiguous coordinate arrays
+
+    Every point occupies a slot in the parallel ids/lat_rad/lng_rad arrays and
+    cells hold slot numbers, so a radius query gathers the candidate slots of
+    the covered cells and measures all of them in one vectorized pass.
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE, capacity: int = 1024):
+        self.cell_size = cell_size
+        self.ids = np.full(capacity, -1, dtype=np.int64)
+        self.lat_rad = np.zeros(capacity, dtype=np.float64)
+        self.lng_rad = np.zeros(capacity, dtype=np.float64)
+        self._used = 0  # Slots handed out so far, including freed ones
+        self._free: List[int] = []
+        self._entries: Dict[int, Tuple[int, Tuple[int, int]]] = {}  # id -> (slot, cell)
+        self._cells: Dict[Tuple[int, int], Set[int]] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_size), math.floor(lng / self.cell_size))
+
+    def _allocate_slot(self) -> int:
+        if self._free:
+            return self._free.pop()
+
+        if self._used == len(self.ids):
+            capacity = len(self.ids) * 2
+            self.ids = np.concatenate([self.ids, np.full(capacity - len(self.ids), -1, dtype=np.int64)])
+            self.lat_rad = np.resize(self.lat_rad, capacity)
+            self.lng_rad = np.resize(self.lng_rad, capacity)
+
+        self._used += 1
+        return self._used - 1
+
+    def _release_slot(self, slot: int) -> None:
+        self.ids[slot] = -1
+        self._free.append(slot)
+
+    def _discard_from_cell(self, cell: Tuple[int, int], slot: int) -> None:
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(slot)
+            if not members:
+                del self._cells[cell]
+
+    def insert(self, item_id: int, lat: float, lng: float) -> None:
+        with self._lock:
+            cell = self.cell(lat, lng)
+            entry = self._entries.get(item_id)
+            if entry is None:
+                slot = self._allocate_slot()
+                self._cells.setdefault(cell, set()).add(slot)
+            else:
+                slot, old_cell = entry
+                if old_cell != cell:
+                    self._discard_from_cell(old_cell, slot)
+                    self._cells.setdefault(cell, set()).add(slot)
+
+            self.ids[slot] = item_id
+            self.lat_rad[slot] = math.radians(lat)
+            self.lng_rad[slot] = math.radians(lng)
+            self._entries[item_id] = (slot, cell)
+
+    def remove(self, item_id: int) -> None:
+        with self._lock:
+            entry = self._entries.pop(item_id, None)
+            if entry is None:
+                return
+            slot, cell = entry
+            self._discard_from_cell(cell, slot)
+            self._release_slot(slot)
+
+    def remove_cells(self, min_row: int, min_col: int, max_row: int, max_col: int) -> None:
+        """Drop every point stored in the given (inclusive) range of cells"""
+        with self._lock:
+            for (row, col) in list(self._cells):
+                if min_row <= row <= max_row and min_col <= col <= max_col:
+                    for slot in self._cells.pop((row, col)):
+                        del self._entries[int(self.ids[slot])]
+                        self._release_slot(slot)
+
+    def query_radius(self, lat: float, lng: float, radius_km: float,
+                     limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Find points within radius_km of (lat, lng)
+
+        Args:
+            limit (Optional[int]): Only return this many of the closest points
+
+        Returns:
+            List[Tuple[int, float]]: (id, distance_km) pairs sorted by distance, then id
+        """
+        min_lat, min_lng, max_lat, max_lng = bounding_box(lat, lng, radius_km)
+        min_row, min_col = self.cell(min_lat, min_lng)
+        max_row, max_col = self.cell(max_lat, max_lng)
+
+        with self._lock:
+            # Walk whichever is smaller: the covered cells or the occupied ones
+            if (max_row - min_row + 1) * (max_col - min_col + 1) > len(self._cells):
+                cells = [members for (row, col), members in self._cells.items()
+                         if min_row <= row <= max_row and min_col <= col <= max_col]
+            else:
+                cells = [self._cells[(row, col)]
+                         for row in range(min_row, max_row + 1)
+                         for col in range(min_col, max_col + 1)
+                         if (row, col) in self._cells]
+
+            slots = np.fromiter(itertools.chain.from_iterable(cells), dtype=np.int64)
+            # Fancy indexing copies, so the arrays below are safe to use unlocked
+            ids = self.ids[slots]
+            lat_rad = self.lat_rad[slots]
+            lng_rad = self.lng_rad[slots]
+
+        # Cheap bounding-box cut before any trigonometry
+        inside = ((lat_rad >= math.radians(min_lat)) & (lat_rad <= math.radians(max_lat)) &
+                  (lng_rad >= math.radians(min_lng)) & (lng_rad <= math.radians(max_lng)))
+        ids, lat_rad, lng_rad = ids[inside], lat_rad[inside], lng_rad[inside]
+
+        distances = haversine_distances(lat, lng, lat_rad, lng_rad)
+        within = distances <= radius_km
+        ids, distances = ids[within], distances[within]
+
+        if limit is not None and limit < len(distances):
+            closest = np.argpartition(distances, limit)[:limit]
+            ids, distances = ids[closest], distances[closest]
+
+        order = np.lexsort((ids, distances))
+        return list(zip(ids[order].tolist(), distances[order].tolist()))
+
+
+class BodegaIndex:
+    """
+    Process-wide spatial index of bodega locations backed by the database
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE, ttl: float = DEFAULT_TTL,
+                 max_blocks: int = MAX_LOADED_BLOCKS):
+        self.grid = SpatialGrid(cell_size)
+        self._loaded_blocks = LRUCache(max_blocks, ttl)  # (block_row, block_col) -> True
+        self._lock = threading.Lock()
+        # Changes applied while a block load is reading the database, replayed
+        # over the loaded rows so a write committed mid-load is not lost
+        self._generation = 0
+        self._loads_in_flight = 0
+        self._recent_changes = []  # (generation, change)
+
+    def invalidate(self) -> None:
+        self._loaded_blocks.clear()
+
+    def _block(self, cell: Tuple[int, int]) -> Tuple[int, int]:
+        return (cell[0] // BLOCK_CELLS, cell[1] // BLOCK_CELLS)
+
+    def _is_loaded(self, block: Tuple[int, int]) -> bool:
+        return self._loaded_blocks.get(block, False)
+
+    def _load_cells(self, lat: float, lng: float, radius_km: float) -> None:
+        """
+        Read any missing or expired blocks covering the search area from the database
+
+        The stale blocks are fetched with a single bounding-box query over the
+        indexed latitude/longitude columns, projecting only the coordinates.
+        """
+        min_lat, min_lng, max_lat, max_lng = bounding_box(lat, lng, radius_km)
+        min_block_row, min_block_col = self._block(self.grid.cell(min_lat, min_lng))
+        max_block_row, max_block_col = self._block(self.grid.cell(max_lat, max_lng))
+
+        stale = [(row, col)
+                 for row in range(min_block_row, max_block_row + 1)
+                 for col in range(min_block_col, max_block_col + 1)
+                 if not self._is_loaded((row, col))]
+        if not stale:
+            return
+
+        min_row = min(row for row, _ in stale) * BLOCK_CELLS
+        max_row = (max(row for row, _ in stale) + 1) * BLOCK_CELLS - 1
+        min_col = min(col for _, col in stale) * BLOCK_CELLS
+        max_col = (max(col for _, col in stale) + 1) * BLOCK_CELLS - 1
+
+        with self._lock:
+            started_at = self._generation
+            self._loads_in_flight += 1
+
+        try:
+            size = self.grid.cell_size
+            rows = db.session.query(Bodega.id, Bodega.latitude, Bodega.longitude).filter(
+                Bodega.latitude.between(min_row * size, (max_row + 1) * size),
+                Bodega.longitude.between(min_col * size, (max_col + 1) * size)
+            ).all()
+
+            with self._lock:
+                self.grid.remove_cells(min_row, min_col, max_row, max_col)
+                for bodega_id, latitude, longitude in rows:
+                    row, col = self.grid.cell(latitude, longitude)
+                    if min_row <= row <= max_row and min_col <= col <= max_col:
+                        self.grid.insert(bodega_id, latitude, longitude)
+                for row in range(min_row // BLOCK_CELLS, max_row // BLOCK_CELLS + 1):
+                    for col in range(min_col // BLOCK_CELLS, max_col // BLOCK_CELLS + 1):
+                        self._loaded_blocks.set((row, col), True)
+
+                # The rows may predate changes committed since the read began
+                for generation, change in self._recent_changes:
+                    if generation > started_at:
+                        self._apply_change(*change)
+        finally:
+            with self._lock:
+                self._loads_in_flight -= 1
+                if not self._loads_in_flight:
+                    self._recent_changes.clear()
+
+    def nearby(self, lat: float, lng: float, radius_km: float,
+               limit: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Find bodegas within radius_km of (lat, lng)
+
+        Args:
+            limit (Optional[int]): Only return this many of the closest bodegas
+
+        Returns:
+            List[Tuple[int, float]]: (bodega_id, distance_km) pairs sorted by distance
+        """
+        self._load_cells(lat, lng, radius_km)
+        return self.grid.query_radius(lat, lng, radius_km, limit)
+
+    def expanding(self, lat: float, lng: float, max_radius_km: float,
+                  limit: Optional[int] = None) -> Iterator[List[Tuple[int, float]]]:
+        """
+        Search outward from (lat, lng), yielding the bodegas within successively
+        doubled radii until max_radius_km is reached
+
+        Callers stop iterating once they have seen enough results, so sparse
+        areas widen the search while dense ones only touch nearby cells.
+        """
+        radius = min(INITIAL_SEARCH_RADIUS, max_radius_km)
+        while True:
+            yield self.nearby(lat, lng, radius, limit)
+            if radius >= max_radius_km:
+                return
+            radius = min(radius * 2, max_radius_km)
+
+    def nearest(self, lat: float, lng: float, k: int, max_radius_km: float) -> List[Tuple[int, float]]:
+        """
+        Find the k bodegas closest to (lat, lng), no further than max_radius_km
+
+        Returns:
+            List[Tuple[int, float]]: (bodega_id, distance_km) pairs sorted by distance
+        """
+        matches = []
+        for matches in self.expanding(lat, lng, max_radius_km, limit=k):
+            if len(matches) >= k:
+                break
+        return matches
+
+    def _apply_change(self, action: str, bodega_id: int,
+                      latitude: Optional[float], longitude: Optional[float]) -> None:
+        if action == 'delete' or latitude is None:
+            # Deleted, or not geocoded yet and so not on the map
+            self.grid.remove(bodega_id)
+        elif self._is_loaded(self._block(self.grid.cell(latitude, longitude))):
+            self.grid.insert(bodega_id, latitude, longitude)
+        else:
+            # The new cell is read from the database on its next query
+            self.grid.remove(bodega_id)
+
+    def apply(self, changes: List[Tuple[str, int, Optional[float], Optional[float]]]) -> None:
+        with self._lock:
+            self._generation += 1
+            for change in changes:
+                self._apply_change(*change)
+                if self._loads_in_flight:
+                    self._recent_changes.append((self._generation, change))
+
+
+bodega_index = BodegaIndex()
+
+
+# Keep the index in sync with bodega writes once they commit
+on_commit(
+    Bodega,
+    lambda bodega, action: (action, bodega.id, bodega.latitude, bodega.longitude),
+    bodega_index.apply
+)
@@ -0,0 +1,75 @@
+"""Per-user profile statistics."""
+
+import os
+import threading
+from typing import Dict, Iterable
+
+from sqlalchemy import func, select
+
+from models import db, SavedCat, SavedBodega, Review, RecentlyViewed
+from utils.cache import LRUCache
+from utils.commit_hooks import on_commit
+
+# Seconds a user's stats are served from the cache
+DEFAULT_TTL = float(os.getenv('USER_STATS_TTL', 300))
+# Users whose stats are cached
+DEFAULT_MAX_ENTRIES = int(os.getenv('USER_STATS_MAX_ENTRIES', 10000))
+
+STATS = (
+    ('saved_cats', SavedCat),
+    ('saved_bodegas', SavedBodega),
+    ('reviews', Review),
+    ('recently_viewed', RecentlyViewed),
+)
+
+
+def load_user_stats(user_id: int) -> Dict[str, int]:
+    """Count a user's rows in every stats table in one round trip"""
+    row = db.session.execute(select(*[
+        select(func.count()).select_from(model).where(model.user_id == user_id).scalar_subquery().label(name)
+        for name, model in STATS
+    ])).one()
+    return dict(row._mapping)
+
+
+class UserStatsCache:
+    """
+    TTL cache of per-user stats, invalidated by committed writes
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self._entries = LRUCache(max_entries, ttl)
+        # Bumped on every invalidation so a load racing with a write is not cached
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int) -> Dict[str, int]:
+        with self._lock:
+            stats = self._entries.get(user_id)
+            if stats is not None:
+                return dict(stats)
+            generation = self._generation
+
+        stats = load_user_stats(user_id)
+        with self._lock:
+            if generation == self._generation:
+                self._entries.set(user_id, stats)
+        return dict(stats)
+
+    def invalidate(self, user_ids: Iterable[int]) -> None:
+        with self._lock:
+            self._generation += 1
+            for user_id in user_ids:
+                self._entries.pop(user_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+
+user_stats = UserStatsCache()
+
+# Drop a user's cached stats once a write to one of the counted tables commits
+for _, _model in STATS:
+    on_commit(_model, lambda row, action: row.user_id, user_stats.invalidate)
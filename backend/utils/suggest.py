@@ -0,0 +1,223 @@
+"""Prefix autocomplete over cat names, bodega names, breeds and personality terms."""
+
+import bisect
+import os
+import re
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from flask import current_app
+
+from models import db, Cat, Bodega
+from utils.commit_hooks import on_commit
+
+# Seconds before the index is rebuilt from the database
+DEFAULT_TTL = float(os.getenv('SUGGEST_INDEX_TTL', 300))
+
+_WORD_START = re.compile(r'(?<!\w)\w')
+
+
+def normalize(text: str) -> str:
+    return ' '.join(text.lower().split())
+
+
+class PrefixIndex:
+    """
+    Sorted array of (match_text, kind, text) keys supporting prefix lookups
+
+    Each source (e.g. one cat) contributes a set of (kind, text) terms. Keys
+    are reference counted, so a breed shared by many cats is stored once and
+    only disappears when the last cat with that breed does.
+    """
+
+    def __init__(self):
+        self._keys: List[Tuple[str, str, str]] = []
+        self._refs: Dict[Tuple[str, str, str], int] = {}
+        self._sources: Dict[Tuple[str, int], List[Tuple[str, str, str]]] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    @classmethod
+    def build(cls, sources: Iterable[Tuple[Tuple[str, int], List[Tuple[str, str]]]]) -> 'PrefixIndex':
+        """Index many sources at once, sorting the keys a single time"""
+        index = cls()
+        for source, terms in sources:
+            keys = cls._keys_for(terms)
+            if keys:
+                index._sources[source] = keys
+                for key in keys:
+                    index._refs[key] = index._refs.get(key, 0) + 1
+        index._keys = sorted(index._refs)
+        return index
+
+    @staticmethod
+    def _keys_for(terms: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+        keys = set()
+        for kind, text in terms:
+            normalized = normalize(text)
+            for match in _WORD_START.finditer(normalized):
+                keys.add((normalized[match.start():], kind, text.strip()))
+        return list(keys)
+
+    def _add(self, key: Tuple[str, str, str]) -> None:
+        refs = self._refs.get(key, 0)
+        if refs == 0:
+            bisect.insort(self._keys, key)
+        self._refs[key] = refs + 1
+
+    def _discard(self, key: Tuple[str, str, str]) -> None:
+        refs = self._refs[key] - 1
+        if refs:
+            self._refs[key] = refs
+        else:
+            del self._refs[key]
+            del self._keys[bisect.bisect_left(self._keys, key)]
+
+    def set_source(self, source: Tuple[str, int], terms: List[Tuple[str, str]]) -> None:
+        """Replace the terms contributed by a source; an empty list removes it"""
+        keys = self._keys_for(terms)
+        with self._lock:
+            for key in self._sources.pop(source, []):
+                self._discard(key)
+            for key in keys:
+                self._add(key)
+            if keys:
+                self._sources[source] = keys
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[str, str]]:
+        """
+        Find terms with a word starting with prefix
+
+        Returns:
+            List[Tuple[str, str]]: Up to limit distinct (kind, text) pairs
+        """
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+
+        results = []
+        seen = set()
+        with self._lock:
+            i = bisect.bisect_left(self._keys, (prefix,))
+            while i < len(self._keys) and len(results) < limit:
+                match_text, kind, text = self._keys[i]
+                if not match_text.startswith(prefix):
+                    break
+                if (kind, text) not in seen:
+                    seen.add((kind, text))
+                    results.append((kind, text))
+                i += 1
+        return results
+
+
+def cat_terms(name: str, breed: Optional[str], personality: Optional[str]) -> List[Tuple[str, str]]:
+    terms = [('cat', name)]
+    if breed and breed.strip():
+        terms.append(('breed', breed))
+    for trait in (personality or '').split(','):
+        if trait.strip():
+            terms.append(('personality', trait))
+    return terms
+
+
+class SuggestionIndex:
+    """
+    Process-wide prefix index of cats and bodegas backed by the database
+    """
+
+    def __init__(self, ttl: float = DEFAULT_TTL):
+        self.ttl = ttl
+        self.index: Optional[PrefixIndex] = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        # Changes committed while a rebuild runs, replayed onto the new index
+        self._pending: Optional[List[Tuple[Tuple[str, int], List[Tuple[str, str]]]]] = None
+
+    def _sources(self):
+        cats = db.session.query(Cat.id, Cat.name, Cat.breed, Cat.personality).filter(
+            Cat.is_active == True
+        ).all()
+        for cat_id, name, breed, personality in cats:
+            yield ('cat', cat_id), cat_terms(name, breed, personality)
+
+        for bodega_id, name in db.session.query(Bodega.id, Bodega.name).all():
+            yield ('bodega', bodega_id), [('bodega', name)]
+
+    def rebuild(self) -> None:
+        """Build a new index from the database and swap it in"""
+        with self._lock:
+            if self._pending is None:
+                self._pending = []
+        try:
+            index = PrefixIndex.build(self._sources())
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+
+        with self._lock:
+            for source, terms in self._pending or []:
+                index.set_source(source, terms)
+            self._pending = None
+            self.index = index
+            self._loaded_at = time.monotonic()
+
+    def _rebuild_in_background(self, app) -> None:
+        with app.app_context():
+            try:
+                self.rebuild()
+            except Exception as e:
+                print(f"Warning: failed to rebuild the suggestion index: {e}")
+            finally:
+                db.session.remove()
+
+    def suggest(self, prefix: str, limit: int) -> List[Tuple[str, str]]:
+        if self.index is None:
+            self.rebuild()
+        elif time.monotonic() - self._loaded_at > self.ttl:
+            # Keep serving the current index while a fresh one is built
+            with self._lock:
+                start = self._pending is None
+                if start:
+                    self._pending = []
+            if start:
+                threading.Thread(
+                    target=self._rebuild_in_background,
+                    args=(current_app._get_current_object(),),
+                    name='suggest-rebuild',
+                    daemon=True
+                ).start()
+        return self.index.suggest(prefix, limit)
+
+    def apply(self, changes: List[Tuple[Tuple[str, int], List[Tuple[str, str]]]]) -> None:
+        with self._lock:
+            index = self.index
+            if self._pending is not None:
+                self._pending.extend(changes)
+        if index is None:
+            return  # Nothing loaded yet; the next lookup reads fresh rows
+
+        for source, terms in changes:
+            index.set_source(source, terms)
+
+
+suggestion_index = SuggestionIndex()
+
+
+# Keep the index in sync with cat and bodega writes once they commit
+on_commit(
+    Cat,
+    lambda cat, action: (
+        ('cat', cat.id),
+        cat_terms(cat.name, cat.breed, cat.personality) if action != 'delete' and cat.is_active else []
+    ),
+    suggestion_index.apply
+)
+on_commit(
+    Bodega,
+    lambda bodega, action: (('bodega', bodega.id), [('bodega', bodega.name)] if action != 'delete' else []),
+    suggestion_index.apply
+)
@@ -0,0 +1,238 @@
+"""Write-behind recording of recently viewed cats and bodegas."""
+
+import atexit
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import bindparam, delete, func, insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Cat, Bodega, RecentlyViewed
+from utils.stats import user_stats
+
+# Milliseconds between flushes of the buffer
+DEFAULT_FLUSH_INTERVAL = float(os.getenv('RECENTLY_VIEWED_FLUSH_MS', 1000))
+# Distinct pending views that trigger an early flush
+DEFAULT_FLUSH_EVENTS = int(os.getenv('RECENTLY_VIEWED_FLUSH_EVENTS', 500))
+# Pending views kept when writes fail before new ones are dropped
+DEFAULT_MAX_PENDING = int(os.getenv('RECENTLY_VIEWED_MAX_PENDING', 10000))
+# Distinct items kept per user
+HISTORY_LIMIT = int(os.getenv('RECENTLY_VIEWED_LIMIT', 50))
+# Users compacted per transaction
+DEFAULT_BATCH_SIZE = 1000
+
+ViewKey = Tuple[int, Optional[int], Optional[int]]  # (user_id, cat_id, bodega_id)
+
+
+def _upsert(rows: List[dict], item_column: str) -> None:
+    """Insert views of one kind of item, moving viewed_at forward on existing rows"""
+    if not rows:
+        return
+
+    dialect = db.engine.dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = (postgresql if dialect == 'postgresql' else sqlite).insert(RecentlyViewed)
+        db.session.execute(statement.on_conflict_do_update(
+            index_elements=['user_id', item_column],
+            set_={'viewed_at': statement.excluded.viewed_at}
+        ), rows)
+        return
+
+    # No portable upsert elsewhere: update the rows that exist, then insert the rest
+    item = getattr(RecentlyViewed, item_column)
+    updated = db.session.execute(
+        update(RecentlyViewed).where(
+            RecentlyViewed.user_id == bindparam('b_user_id'), item == bindparam('b_item_id')
+        ).values(viewed_at=bindparam('b_viewed_at')).execution_options(synchronize_session=False),
+        [{'b_user_id': row['user_id'], 'b_item_id': row[item_column], 'b_viewed_at': row['viewed_at']}
+         for row in rows]
+    )
+    if updated.rowcount != len(rows):
+        existing = set(db.session.execute(
+            select(RecentlyViewed.user_id, item).where(
+                RecentlyViewed.user_id.in_({row['user_id'] for row in rows}),
+                item.in_({row[item_column] for row in rows})
+            )
+        ).all())
+        new_rows = [row for row in rows if (row['user_id'], row[item_column]) not in existing]
+        if new_rows:
+            db.session.execute(insert(RecentlyViewed), new_rows)
+
+
+def trim_history(user_ids: List[int], limit: int = HISTORY_LIMIT) -> int:
+    """
+    Delete all but the latest `limit` items of each user; the caller commits
+
+    Returns:
+        int: Number of rows deleted
+    """
+    if not user_ids:
+        return 0
+
+    table = RecentlyViewed.__table__
+    user_id = bindparam('b_user_id')
+    kept = select(table.c.id).where(table.c.user_id == user_id).order_by(
+        table.c.viewed_at.desc(), table.c.id.desc()
+    ).limit(limit)
+    result = db.session.execute(
+        delete(table).where(table.c.user_id == user_id, table.c.id.not_in(kept.scalar_subquery())),
+        [{'b_user_id': user_id} for user_id in user_ids]
+    )
+    return max(result.rowcount, 0)
+
+
+def write_views(rows: List[dict]) -> None:
+    """Upsert view rows and trim the histories they extend; the caller commits"""
+    _upsert([row for row in rows if row['cat_id'] is not None], 'cat_id')
+    _upsert([row for row in rows if row['bodega_id'] is not None], 'bodega_id')
+    trim_history(sorted({row['user_id'] for row in rows}))
+
+
+def _existing_views(rows: List[dict]) -> List[dict]:
+    """The rows whose cat or bodega still exists"""
+    cat_ids = {row['cat_id'] for row in rows if row['cat_id'] is not None}
+    bodega_ids = {row['bodega_id'] for row in rows if row['bodega_id'] is not None}
+    cats = set(db.session.scalars(select(Cat.id).where(Cat.id.in_(cat_ids)))) if cat_ids else set()
+    bodegas = set(db.session.scalars(select(Bodega.id).where(Bodega.id.in_(bodega_ids)))) if bodega_ids else set()
+    return [row for row in rows if row['cat_id'] in cats or row['bodega_id'] in bodegas]
+
+
+class ViewBuffer:
+    """
+    Buffer of view events flushed to the database by a background thread
+    """
+
+    def __init__(self, flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+                 flush_events: int = DEFAULT_FLUSH_EVENTS, max_pending: int = DEFAULT_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.flush_events = flush_events
+        self.max_pending = max_pending
+        self.app = None
+        self._pending: Dict[ViewKey, datetime] = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def init_app(self, app) -> None:
+        self.app = app
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='recently-viewed-writer', daemon=True)
+            self._thread.start()
+            # Views still buffered when a process is killed are lost, which a history list can afford
+            atexit.register(self.flush)
+
+    def record(self, user_id: int, cat_id: Optional[int] = None, bodega_id: Optional[int] = None) -> None:
+        """Queue a view of a cat or bodega by a user"""
+        key = (user_id, cat_id, bodega_id)
+        with self._lock:
+            if key not in self._pending and len(self._pending) >= self.max_pending:
+                return
+            self._pending[key] = datetime.utcnow()
+            full = len(self._pending) >= self.flush_events
+        if full:
+            self._wake.set()
+
+    def discard(self, user_id: int) -> None:
+        """Drop the pending views of a user, e.g. when they clear their history"""
+        with self._lock:
+            for key in [key for key in self._pending if key[0] == user_id]:
+                del self._pending[key]
+
+    def _requeue(self, pending: Dict[ViewKey, datetime]) -> None:
+        with self._lock:
+            for key, viewed_at in pending.items():
+                if key in self._pending:
+                    self._pending[key] = max(self._pending[key], viewed_at)
+                elif len(self._pending) < self.max_pending:
+                    self._pending[key] = viewed_at
+
+    def flush(self) -> int:
+        """
+        Write the pending views to the database
+
+        Returns:
+            int: Number of view rows written
+        """
+        if self.app is None:
+            return 0
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+
+            rows = [
+                {'user_id': user_id, 'cat_id': cat_id, 'bodega_id': bodega_id, 'viewed_at': viewed_at}
+                for (user_id, cat_id, bodega_id), viewed_at in pending.items()
+            ]
+            with self.app.app_context():
+                try:
+                    try:
+                        write_views(rows)
+                        db.session.commit()
+                    except IntegrityError:
+                        # A viewed item was deleted before the flush; keep the rest
+                        db.session.rollback()
+                        rows = _existing_views(rows)
+                        if rows:
+                            write_views(rows)
+                        db.session.commit()
+                    # Upserts and trims bypass the ORM, so no commit hook sees them
+                    user_stats.invalidate({row['user_id'] for row in rows})
+                    return len(rows)
+                except Exception as e:
+                    db.session.rollback()
+                    self._requeue(pending)
+                    print(f"Warning: failed to write {len(rows)} recently viewed rows: {e}")
+                    return 0
+                finally:
+                    db.session.remove()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval / 1000)
+            self._wake.clear()
+            self.flush()
+
+
+view_buffer = ViewBuffer()
+
+
+def compact_history(limit: int = HISTORY_LIMIT, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """
+    Trim every user's history to `limit` items, one batch of users per transaction
+
+    Returns:
+        int: Number of rows deleted
+    """
+    deleted = 0
+    after = 0
+    while True:
+        user_ids = list(db.session.scalars(
+            select(RecentlyViewed.user_id).where(RecentlyViewed.user_id > after).group_by(
+                RecentlyViewed.user_id
+            ).having(func.count() > limit).order_by(RecentlyViewed.user_id).limit(batch_size)
+        ))
+        if not user_ids:
+            return deleted
+
+        deleted += trim_history(user_ids, limit)
+        db.session.commit()
+        user_stats.invalidate(user_ids)
+        after = user_ids[-1]
+
+
+@click.command('compact-recently-viewed')
+@click.option('--limit', default=HISTORY_LIMIT, show_default=True, help='Items kept per user.')
+@click.option('--batch-size', default=DEFAULT_BATCH_SIZE, show_default=True, help='Users per transaction.')
+@with_appcontext
+def compact_command(limit, batch_size):
+    """Trim recently viewed histories to the per-user limit."""
+    print(f"Removed {compact_history(limit, batch_size)} recently viewed rows")